@@ -2,16 +2,61 @@
 
 import json
 import logging
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import pyarrow as pa
 from .llm_agent import llm
 from .toolkits.fetch import extract_relevant_data
 from .toolkits.analyze import analyze_data
-from .toolkits.duckdb_runner import retrieve_data_as_df
+from .toolkits.duckdb_runner import retrieve_data_as_arrow
 from .toolkits.file_handler import handle_file_task
 
 logger = logging.getLogger(__name__)
 
+# Plan-extraction patterns, compiled once rather than on every attempt
+_PLAN_ARRAY_RE = re.compile(r'\[\s*\{.*?\}\s*(?:,\s*\{.*?\}\s*)*\]', re.DOTALL)
+_ANY_ARRAY_RE = re.compile(r'(\[[\s\S]*\])')
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+
+def _attachment_context(fname: str, fcontent: bytes) -> str:
+    """Writes one attachment to a temp file and returns its line for the planner's file context."""
+    ext = os.path.splitext(fname)[-1].lower()
+    temp_path = None
+    preview = ""
+    # Save to temp file to get a path
+    import tempfile
+    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+        tmp.write(fcontent)
+        temp_path = tmp.name
+    # Try to preview content for CSV/Excel
+    try:
+        if ext in [".csv", ".txt"]:
+            df = pd.read_csv(temp_path, nrows=5)
+            preview = f"\nPreview (first 5 rows):\n{df.head().to_markdown()}"
+        elif ext in [".xlsx", ".xls"]:
+            df = pd.read_excel(temp_path, nrows=5)
+            preview = f"\nPreview (first 5 rows):\n{df.head().to_markdown()}"
+        elif ext == ".pdf":
+            preview = "PDF file (preview not shown)"
+        elif ext in [".png", ".jpg", ".jpeg", ".gif", ".bmp"]:
+            import binascii
+            # Encode the bytes already in memory instead of reading back the temp file just written
+            b64 = binascii.b2a_base64(memoryview(fcontent), newline=False).decode("ascii")
+            mime = "image/png" if ext == ".png" else (
+                "image/jpeg" if ext in [".jpg", ".jpeg"] else (
+                "image/gif" if ext == ".gif" else (
+                "image/bmp" if ext == ".bmp" else "application/octet-stream")))
+            preview = f"data:{mime};base64,{b64}"
+        else:
+            preview = "File loaded"
+    except Exception as e:
+        logger.warning(f"Preview error for {fname}: {e}")
+        preview = "File loaded (preview unavailable)"
+
+    return f"File: {fname}, Path: {temp_path}{preview}\n"
+
 def get_plan(task_text: str, file_context: str = "") -> list:
     """
     Generates a structured, multi-step plan for which tools to run in order.
@@ -33,7 +78,7 @@ def get_plan(task_text: str, file_context: str = "") -> list:
 -- **duckdb_runner.retrieve_data_as_df(task: str, full_task_context: str)**:
     - **Use Case**: Use this tool ONLY if the user explicitly mentions DuckDB, SQL, or S3 in the question. Do NOT use for uploaded files unless SQL or DuckDB is specifically requested. This tool will autonomously generate and execute the necessary SQL.
     - **Input**: The `tool_input` MUST be a clear and specific STRING describing the sub-task for this step (not a dictionary or other type). The `full_task_context` is handled automatically by the agent.
-    - **Returns**: A pandas DataFrame or the final answer as string.
+    - **Returns**: A pyarrow Table (pass it to `analyze.analyze_data`, which reads Arrow tables directly) or the final answer as string.
 
 - **fetch.extract_relevant_data(url: str, task_description: str)**:
     - **Use Case**: Use for scraping a standard webpage URL.
@@ -117,10 +162,10 @@ You are an Expert AI Planner. Your role is to create the most logical and effici
             
             # Try to find JSON array more robustly
             # First try to find the JSON array
-            match = re.search(r'\[\s*\{.*?\}\s*(?:,\s*\{.*?\}\s*)*\]', plan_str, re.DOTALL)
+            match = _PLAN_ARRAY_RE.search(plan_str)
             if not match:
                 # Try alternative pattern
-                match = re.search(r'(\[[\s\S]*\])', plan_str)
+                match = _ANY_ARRAY_RE.search(plan_str)
             
             if not match:
                 raise ValueError("LLM did not return a valid JSON list. Response: " + plan_str[:500])
@@ -131,7 +176,7 @@ You are an Expert AI Planner. Your role is to create the most logical and effici
             # Clean up common JSON issues
             json_str = json_str.replace('\n', ' ').replace('\r', ' ')
             # Fix common trailing comma issues
-            json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
+            json_str = _TRAILING_COMMA_RE.sub(r'\1', json_str)
             
             plan = json.loads(json_str)
             
@@ -185,44 +230,9 @@ def handle_task(task_text: str, attachments: dict = None, max_global_retries: in
             import pandas as pd
             import io
             if attachments:
-                for fname, fcontent in attachments.items():
-                    ext = os.path.splitext(fname)[-1].lower()
-                    temp_path = None
-                    preview = ""
-                    # Save to temp file to get a path
-                    import tempfile
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-                        tmp.write(fcontent)
-                        temp_path = tmp.name
-                    # Try to preview content for CSV/Excel
-                    try:
-                        if ext in [".csv", ".txt"]:
-                            df = pd.read_csv(temp_path, nrows=5)
-                            preview = f"\nPreview (first 5 rows):\n{df.head().to_markdown()}"
-                        elif ext in [".xlsx", ".xls"]:
-                            df = pd.read_excel(temp_path, nrows=5)
-                            preview = f"\nPreview (first 5 rows):\n{df.head().to_markdown()}"
-                        elif ext == ".pdf":
-                            preview = "PDF file (preview not shown)"
-                        elif ext in [".png", ".jpg", ".jpeg", ".gif", ".bmp"]:
-                            import base64
-                            with open(temp_path, "rb") as img_f:
-                                img_bytes = img_f.read()
-                                b64 = base64.b64encode(img_bytes).decode("utf-8")
-                                mime = "image/png" if ext == ".png" else (
-                                    "image/jpeg" if ext in [".jpg", ".jpeg"] else (
-                                    "image/gif" if ext == ".gif" else (
-                                    "image/bmp" if ext == ".bmp" else "application/octet-stream")))
-                                preview = f"data:{mime};base64,{b64}"
-                        else:
-                            preview = "File loaded"
-                    except Exception as e:
-                        logger.warning(f"Preview error for {fname}: {e}")
-                        preview = "File loaded (preview unavailable)"
-                    
-                    if temp_path:
-                        tool_inputs = f"File: {fname}, Path: {temp_path}{preview}"
-                        file_context += tool_inputs + "\n"
+                # Attachments are written and previewed concurrently so file I/O and parsing overlap across files
+                with ThreadPoolExecutor(max_workers=min(8, len(attachments))) as executor:
+                    file_context = "".join(executor.map(_attachment_context, attachments.keys(), attachments.values()))
             plan = get_plan(full_task_text, file_context=file_context)
 
             data_context = {}
@@ -252,7 +262,8 @@ def handle_task(task_text: str, attachments: dict = None, max_global_retries: in
                 if tool_name == "duckdb_runner.retrieve_data_as_df":
                     if not isinstance(tool_input, str):
                         raise TypeError(f"Expected a string for duckdb_runner input, but got {type(tool_input)}")
-                    step_result = retrieve_data_as_df(task=tool_input, full_task_context=full_task_text)
+                    # The tool keeps its planner-facing name, but the result stays Arrow until analyze_data needs pandas
+                    step_result = retrieve_data_as_arrow(task=tool_input, full_task_context=full_task_text)
 
                 elif tool_name == "fetch.extract_relevant_data":
                     if not isinstance(tool_input, dict):
@@ -338,6 +349,9 @@ def handle_task(task_text: str, attachments: dict = None, max_global_retries: in
 
                 if isinstance(step_result, pd.DataFrame):
                     results["dataframe_preview"] += f"\n--- Preview for Step: {step_name} ---\n{step_result.head().to_markdown()}"
+                elif isinstance(step_result, pa.Table):
+                    # Only the previewed rows are converted to pandas
+                    results["dataframe_preview"] += f"\n--- Preview for Step: {step_name} ---\n{step_result.slice(0, 5).to_pandas().to_markdown()}"
                 else:
                     results["final_answers"] = step_result
 
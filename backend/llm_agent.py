@@ -1,6 +1,13 @@
 from google import genai
 from openai import OpenAI  # Updated import
+import hashlib
+import logging
 import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -51,6 +58,110 @@ def llm(prompt: str) -> str:
     except Exception as e:
         return f"LLM error: {str(e)}"
 
+# --- Prompt cache: exact SHA-256 lookup on the whitespace-normalised prompt ---
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite")
+LLM_CACHE_TTL_S = 7 * 24 * 3600
+LLM_CACHE_VERSION = 1  # bump whenever the prompt templates change so old answers stop matching
+_EMBEDDER_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'  # local model for table selection in fetch
+
+_WS_RE = re.compile(r"\s+")
+_CACHE_DB = None
+_CACHE_LOCK = threading.Lock()
+_EMBEDDER = None
+
+def get_embedder():
+    """Returns the shared SentenceTransformer (loaded once), or None when sentence-transformers isn't installed."""
+    global _EMBEDDER
+    if _EMBEDDER is None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            _EMBEDDER = False
+        else:
+            logger.info(f"Loading embedding model {_EMBEDDER_MODEL}...")
+            _EMBEDDER = SentenceTransformer(_EMBEDDER_MODEL)
+    return _EMBEDDER or None
+
+def _cache_db() -> sqlite3.Connection:
+    global _CACHE_DB
+    if _CACHE_DB is None:
+        _CACHE_DB = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+        _CACHE_DB.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " namespace TEXT, version INTEGER, hash TEXT, response TEXT, created REAL,"
+            " PRIMARY KEY (namespace, version, hash))"
+        )
+    return _CACHE_DB
+
+def _prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(_WS_RE.sub(" ", prompt).strip().encode()).hexdigest()
+
+def cache_put(prompt: str, namespace: str, response: str):
+    """Stores `response` as the cached answer to `prompt`, e.g. once the caller has validated it."""
+    if not LLM_CACHE_ENABLED or response.startswith("LLM error"):
+        return
+    with _CACHE_LOCK:
+        _cache_db().execute(
+            "INSERT OR REPLACE INTO llm_cache (namespace, version, hash, response, created) VALUES (?, ?, ?, ?, ?)",
+            (namespace, LLM_CACHE_VERSION, _prompt_hash(prompt), response, time.time()),
+        )
+        _cache_db().commit()
+
+def cached_llm(prompt: str, namespace: str, store: bool = True) -> str:
+    """
+    `llm(prompt)` behind a persistent cache keyed by (namespace, prompt version, prompt hash), with a 7-day TTL.
+    With `store=False` a miss is not written back; the caller stores the answer with `cache_put`
+    only once it has checked that the answer works. LLM errors are never cached.
+    """
+    if not LLM_CACHE_ENABLED:
+        return llm(prompt)
+
+    prompt_hash = _prompt_hash(prompt)
+    cutoff = time.time() - LLM_CACHE_TTL_S
+
+    with _CACHE_LOCK:
+        row = _cache_db().execute(
+            "SELECT response FROM llm_cache WHERE namespace=? AND version=? AND hash=? AND created>?",
+            (namespace, LLM_CACHE_VERSION, prompt_hash, cutoff),
+        ).fetchone()
+    if row:
+        logger.info(f"⚡ LLM cache hit ({namespace}).")
+        return row[0]
+
+    response = llm(prompt)
+    if store:
+        cache_put(prompt, namespace, response)
+    return response
+
+def llm_many(prompts: list, call=None) -> list:
+    """
+    Runs independent prompts concurrently from synchronous code and returns the answers in order.
+    Uses threads rather than `asyncio.run`, so it is safe to call while an event loop is running
+    (e.g. from the FastAPI handlers). `call` defaults to `llm`; pass e.g. a `cached_llm` partial.
+    """
+    call = call or llm
+    if len(prompts) <= 1:
+        return [call(p) for p in prompts]
+    with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+        return list(executor.map(call, prompts))
+
+# Speculative corrections: after a failure, several differently-phrased fix requests are sent at
+# once and the first candidate that runs is kept, so a bad fix doesn't cost a full extra round-trip.
+LLM_CORRECTION_FANOUT = max(1, int(os.getenv("LLM_CORRECTION_FANOUT", "3")))
+_CORRECTION_HINTS = [
+    "",
+    "\nIf the failed approach looks fundamentally wrong, take a different approach instead of patching it.",
+    "\nPrefer the simplest robust solution and guard against missing elements, columns and empty values.",
+]
+
+def correction_variants(prompt: str, k: int = None) -> list:
+    """`k` (default LLM_CORRECTION_FANOUT) phrasings of the same correction prompt; the first is unchanged."""
+    k = k or LLM_CORRECTION_FANOUT
+    return [prompt + _CORRECTION_HINTS[i % len(_CORRECTION_HINTS)] for i in range(k)]
+
 def llm_vision(prompt: str, image_path: str) -> str:
     """
     LLM interface for vision tasks - sends image with prompt to LLM.
@@ -58,7 +169,7 @@ def llm_vision(prompt: str, image_path: str) -> str:
     try:
         if LLM_PROVIDER == "gemini":
             # Read and encode image
-            import base64
+            import binascii
             import mimetypes
             
             # Detect MIME type
@@ -67,7 +178,7 @@ def llm_vision(prompt: str, image_path: str) -> str:
                 mime_type = "image/jpeg"  # Default fallback
             
             with open(image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
+                image_data = binascii.b2a_base64(image_file.read(), newline=False).decode('ascii')
             
             # Create content with image and text
             response = gemini_client.models.generate_content(
@@ -90,7 +201,7 @@ def llm_vision(prompt: str, image_path: str) -> str:
         
         elif LLM_PROVIDER == "openai":
             # OpenAI Vision API
-            import base64
+            import binascii
             import mimetypes
             
             # Detect MIME type for data URI
@@ -99,7 +210,7 @@ def llm_vision(prompt: str, image_path: str) -> str:
                 mime_type = "image/jpeg"  # Default fallback
             
             with open(image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
+                image_data = binascii.b2a_base64(image_file.read(), newline=False).decode('ascii')
             
             response = openai_client.chat.completions.create(
                 model="gpt-4o-mini",  # or gpt-4-vision-preview
@@ -1,12 +1,14 @@
 # backend/main.py
 
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from backend.agent import handle_task
+from backend.toolkits.sandbox import warm_pool
 from dotenv import load_dotenv
 
 # ==================== LOGGING CONFIGURATION ====================
@@ -24,7 +26,13 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the analysis sandbox workers now rather than inside the first request's time limit
+    warm_pool()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS
 app.add_middleware(
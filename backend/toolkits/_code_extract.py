@@ -0,0 +1,123 @@
+# backend/toolkits/_code_extract.py
+
+import ast
+import builtins
+import collections
+import functools
+import hashlib
+import linecache
+import re
+
+# Shared helpers for turning LLM responses into runnable code. Patterns are compiled once per
+# process and are non-greedy so an unbalanced fence can't backtrack across the whole response.
+_PY_FENCE = re.compile(r'```(?:python\n)?(.*?)```', re.DOTALL)
+_SQL_FENCE = re.compile(r'```(?:sql\n)?(.*?)```', re.DOTALL)
+
+# Imports `auto_repair` (and analyze's local NameError fix) may add for a name the code uses but never binds
+_KNOWN_IMPORTS = {
+    "pd": "import pandas as pd",
+    "np": "import numpy as np",
+    "plt": "import matplotlib.pyplot as plt",
+    "sns": "import seaborn as sns",
+    "stats": "from scipy import stats",
+    "re": "import re",
+    "os": "import os",
+    "io": "import io",
+    "json": "import json",
+    "math": "import math",
+    "datetime": "import datetime",
+    "base64": "import base64",
+    "requests": "import requests",
+    "BeautifulSoup": "from bs4 import BeautifulSoup",
+}
+# `pd.<name>(...)` calls whose assigned target is taken to be a DataFrame
+_FRAME_FACTORIES = {"DataFrame", "concat", "json_normalize", "merge", "pivot_table", "crosstab"}
+
+_MAX_REGISTERED = 256
+_REGISTERED = collections.deque()  # linecache names added by compile_code, oldest first
+
+def extract_python_code(llm_response: str) -> str:
+    """Extracts Python code from an LLM response."""
+    match = _PY_FENCE.search(llm_response)
+    if match:
+        return match.group(1).strip()
+    return llm_response.strip()
+
+def extract_sql_code(llm_response: str) -> str:
+    """Extracts SQL code from an LLM response that might be wrapped in Markdown."""
+    match = _SQL_FENCE.search(llm_response)
+    if match:
+        return match.group(1).strip()
+    return llm_response.strip()
+
+def _bound_names(tree: ast.AST) -> set:
+    """Every name the code binds anywhere (assignments, loop/with targets, imports, defs, arguments)."""
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.add(node.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            bound.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+    return bound
+
+def _frame_names(tree: ast.Module) -> list:
+    """Top-level names assigned from a pandas DataFrame constructor/reader (`pd.DataFrame(...)`, `pd.read_*(...)`)."""
+    names = []
+    for node in tree.body:
+        if not (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)):
+            continue
+        func = node.value.func
+        if not (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == "pd"):
+            continue
+        if func.attr in _FRAME_FACTORIES or func.attr.startswith("read_"):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id not in names:
+                    names.append(target.id)
+    return names
+
+def auto_repair(code: str, namespace: dict):
+    """
+    Static first pass over generated code, run before an LLM correction is paid for. Prepends the import
+    for any well-known module alias the code uses without binding (and `namespace` doesn't provide), and
+    appends `result = <name>` when `result` is never assigned but exactly one DataFrame is built.
+    Returns the repaired code, or None when there is nothing to repair (or the code doesn't parse).
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    bound = _bound_names(tree)
+    loaded = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+    missing = sorted(name for name in loaded - bound - namespace.keys() - vars(builtins).keys() if name in _KNOWN_IMPORTS)
+
+    fixed = code
+    if missing:
+        fixed = "\n".join(_KNOWN_IMPORTS[name] for name in missing) + "\n" + fixed
+    if "result" not in bound:
+        frames = _frame_names(tree)
+        if len(frames) == 1:
+            fixed = f"{fixed}\nresult = {frames[0]}"
+    return fixed if fixed != code else None
+
+@functools.lru_cache(maxsize=256)
+def compile_code(source: str, filename: str = '<generated>'):
+    """
+    Compiles LLM-generated source once and caches the code object, so retries that
+    re-run identical code skip recompilation. SyntaxErrors surface before execution.
+    The source is registered with linecache under a per-source name (e.g. `<analysis-1a2b3c4d5e6f>`),
+    so tracebacks fed to the correction prompts show the offending lines, not just line numbers.
+    """
+    digest = hashlib.blake2b(source.encode(), digest_size=6).hexdigest()
+    name = f"{filename[:-1]}-{digest}>" if filename.endswith('>') else f"{filename}-{digest}"
+    linecache.cache[name] = (len(source), None, source.splitlines(True), name)
+    _REGISTERED.append(name)
+    if len(_REGISTERED) > _MAX_REGISTERED:
+        # Keep the linecache bounded like the code-object cache in a long-running server
+        linecache.cache.pop(_REGISTERED.popleft(), None)
+    return compile(source, name, 'exec')
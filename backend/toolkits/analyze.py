@@ -1,34 +1,179 @@
 # backend/toolkits/analyze.py
 
 import pandas as pd
+import pyarrow as pa
 import logging
 import io
+import os
+# Pick the non-interactive backend through the environment before anything imports matplotlib,
+# so matplotlib never goes through backend discovery
+os.environ.setdefault("MPLBACKEND", "Agg")
 import gc  # For garbage collection in memory optimization
 from backend.llm_agent import llm
-from .fetch import extract_python_code # Reuse the code extractor
+from ._code_extract import extract_python_code, compile_code, _KNOWN_IMPORTS # Shared code extractor, compile cache and import map
+from .duckdb_runner import execute_query_streaming, sum_batches, concat_batches
+from .fast_kernels import KERNELS
+from .sandbox import run_in_sandbox, restore_context, close_handles
 
 # We need to import all libraries that the LLM might use in its code
 import re
-import matplotlib
-matplotlib.use('Agg') # Use a non-interactive backend for plotting
+import importlib
 import matplotlib.pyplot as plt
-import seaborn as sns
 import io
 import base64
 import json
-import altair as alt
-from scipy import stats
+import orjson
 import traceback # <-- Import the traceback module
+import difflib
 
 logger = logging.getLogger(__name__)
 
-def _correct_analysis_code(failed_code: str, error_message: str, task: str, data_context_preview: str) -> str:
+# Generated analysis code runs in a worker process by default; set ANALYSIS_SANDBOX=0 to run in-process
+ANALYSIS_SANDBOX = os.getenv("ANALYSIS_SANDBOX", "1") != "0"
+ANALYSIS_TIMEOUT_S = float(os.getenv("ANALYSIS_TIMEOUT_S", "300"))
+
+class _LazyModule:
+    """Imports the wrapped module on first attribute access, so unused plotting/stats libraries cost nothing."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# seaborn, altair and scipy.stats are only imported once generated code actually touches them
+_LAZY_MODULES = {
+    "sns": _LazyModule("seaborn"),
+    "alt": _LazyModule("altair"),
+    "stats": _LazyModule("scipy.stats"),
+}
+
+def __getattr__(name):
+    # Keeps `analyze.sns` / `analyze.alt` / `analyze.stats` working for external callers
+    if name in _LAZY_MODULES:
+        return importlib.import_module(_LAZY_MODULES[name]._name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _analysis_namespace(data_context: dict) -> dict:
+    """Globals available to the generated analysis script."""
+    return {
+        "data_context": data_context,
+        "pd": pd, "re": re, "plt": plt,
+        "io": io, "base64": base64, "json": _JSON, "pa": pa,
+        **_LAZY_MODULES,
+        "stream": execute_query_streaming, "sum_batches": sum_batches, "concat_batches": concat_batches,
+        **KERNELS,
+        "result": None
+    }
+
+def _run_analysis_code(analysis_code: str, shared_context: dict):
+    """Worker entry point: rebuilds data_context from shared memory, runs the code, returns `result`."""
+    handles = []
+    try:
+        local_vars = _analysis_namespace(restore_context(shared_context, handles))
+        exec(compile_code(analysis_code, '<analysis>'), local_vars)
+        return local_vars.get("result")
+    finally:
+        plt.close('all')
+        local_vars = None
+        close_handles(handles)
+
+def _numpy_default(value):
+    """`default=` hook so the stdlib encoder accepts the numpy values orjson serializes natively."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class _JsonShim:
     """
-    This function acts as an expert debugger. It asks the LLM to correct 
-    failed Python analysis code based on a rich context.
+    Drop-in `json` for generated code. A plain `dumps(obj)` / `loads(s)` goes through orjson
+    (numpy-aware, much faster on large nested results; compact output, NaN written as null).
+    Any keyword argument (indent, separators, ensure_ascii, allow_nan, default, cls, ...) gets the
+    stdlib encoder/decoder so the text is exactly what `json` would produce.
     """
-    logger.info("🤖 Attempting to correct failed analysis code...")
-    prompt = f"""
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs) -> str:
+        if not kwargs:
+            try:
+                return orjson.dumps(obj, option=self._OPTIONS).decode()
+            except TypeError:
+                pass  # e.g. integers beyond 64 bits; the stdlib handles them (or raises its usual message)
+        if 'cls' not in kwargs and kwargs.get('default') is None:
+            kwargs['default'] = _numpy_default
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass  # NaN/Infinity literals or huge integers parse with the stdlib (which raises otherwise)
+        return json.loads(s, **kwargs)
+
+    def __getattr__(self, name):
+        # dump/load/JSONDecodeError/... come from the stdlib module
+        return getattr(json, name)
+
+_JSON = _JsonShim()
+
+def _frame_preview(df: pd.DataFrame) -> str:
+    """Schema plus a 3-row, 8-column CSV sample; the C CSV writer is much cheaper than to_string/markdown."""
+    schema = df.dtypes.to_string()
+    sample = df.iloc[:3, :8].to_csv(index=False)
+    return f"schema:\n{schema}\nsample:\n```\n{sample}```\n"
+
+# Trivial failures that are fixed locally instead of paying for an LLM correction round-trip
+_NAME_ERROR_RE = re.compile(r"name '(\w+)' is not defined")
+_ATTR_ERROR_RE = re.compile(r"object has no attribute '(\w+)'")
+_RENAMED_ATTRS = {"iteritems": "items"}  # pandas 2.x removals with a drop-in replacement
+
+def _context_columns(data_context: dict) -> list:
+    """All column names across the DataFrames/Arrow tables in the data context."""
+    columns = []
+    for data in data_context.values():
+        frames = data.values() if isinstance(data, dict) else [data]
+        for frame in frames:
+            if isinstance(frame, pd.DataFrame):
+                columns.extend(str(c) for c in frame.columns)
+            elif isinstance(frame, pa.Table):
+                columns.extend(frame.column_names)
+    return columns
+
+def _local_fix(code: str, error: Exception, data_context: dict):
+    """
+    Patches well-known trivial errors (missing import, misspelt column, removed pandas API).
+    Returns the fixed code, or None when the error needs the LLM debugger.
+    """
+    fixed = None
+    if isinstance(error, NameError):
+        match = _NAME_ERROR_RE.search(str(error))
+        if match and match.group(1) in _KNOWN_IMPORTS:
+            fixed = f"{_KNOWN_IMPORTS[match.group(1)]}\n{code}"
+    elif isinstance(error, KeyError) and error.args and isinstance(error.args[0], str):
+        missing = error.args[0]
+        columns = _context_columns(data_context)
+        # Case-only mismatches first, then the closest spelling
+        candidates = [c for c in columns if c.lower() == missing.lower()] or difflib.get_close_matches(missing, columns, n=1, cutoff=0.8)
+        if candidates:
+            fixed = code
+            for quote in ("'", '"'):
+                fixed = fixed.replace(f"{quote}{missing}{quote}", f"{quote}{candidates[0]}{quote}")
+    elif isinstance(error, AttributeError):
+        match = _ATTR_ERROR_RE.search(str(error))
+        if match and match.group(1) in _RENAMED_ATTRS:
+            fixed = re.sub(rf"\.{match.group(1)}\b", f".{_RENAMED_ATTRS[match.group(1)]}", code)
+
+    if fixed is None or fixed == code:
+        return None
+    return fixed
+
+def _correction_prompt(failed_code: str, error_message: str, task: str, data_context_preview: str) -> str:
+    """Builds the expert-debugger prompt used to correct failed analysis code."""
+    return f"""
 You are a Senior Python Data Scientist acting as an expert code debugger.
 The following Python script failed to execute. Your task is to analyze the error traceback
 and provide a corrected version of the script.
@@ -61,6 +206,14 @@ and provide a corrected version of the script.
 
 **Corrected Code:**
 """
+
+def _correct_analysis_code(failed_code: str, error_message: str, task: str, data_context_preview: str) -> str:
+    """
+    This function acts as an expert debugger. It asks the LLM to correct 
+    failed Python analysis code based on a rich context.
+    """
+    logger.info("🤖 Attempting to correct failed analysis code...")
+    prompt = _correction_prompt(failed_code, error_message, task, data_context_preview)
     raw_corrected_code = llm(prompt).strip()
     return extract_python_code(raw_corrected_code)
 
@@ -89,6 +242,11 @@ def analyze_data(data_context: dict, task: str, max_retries: int = 3, tool_input
                     total_memory_mb += df_memory
                     if df_memory > 50:
                         large_datasets.append((f"{name}['{sub_name}']", df_memory, sub_df.shape))
+        elif isinstance(data, pa.Table):
+            table_memory = data.nbytes / (1024 * 1024)
+            total_memory_mb += table_memory
+            if table_memory > 50:
+                large_datasets.append((name, table_memory, data.shape))
     
     if large_datasets:
         logger.warning(f"Large datasets detected (Total: {total_memory_mb:.1f}MB): {large_datasets}")
@@ -96,19 +254,10 @@ def analyze_data(data_context: dict, task: str, max_retries: int = 3, tool_input
     context_preview = ""
     for name, data in data_context.items():
         if isinstance(data, pd.DataFrame):
-            # Direct DataFrame with memory optimization
+            # Direct DataFrame: dtypes + a tiny sample keep the prompt small and the preview cheap
             df_memory = data.memory_usage(deep=True).sum() / (1024 * 1024)
-            buffer = io.StringIO()
-            data.info(buf=buffer)
-            df_info = buffer.getvalue()
-            
-            # Optimize preview for large DataFrames
-            preview_rows = 10 if df_memory > 100 else 10  # Show at least 10 rows for better context
-            
-            context_preview += f"DataFrame `{name}` (Memory: {df_memory:.1f}MB):\n"
-            context_preview += f"--- Head ({preview_rows} rows) ---\n{data.head(preview_rows).to_markdown()}\n"
-            context_preview += f"--- Tail ({preview_rows} rows) ---\n{data.tail(preview_rows).to_markdown()}\n"
-            context_preview += f"--- Info ---\n{df_info}\n---\n\n"
+            context_preview += f"DataFrame `{name}` (Memory: {df_memory:.1f}MB, Shape: {data.shape}):\n"
+            context_preview += _frame_preview(data) + "---\n\n"
         
         elif isinstance(data, dict):
             # Dictionary of DataFrames (e.g., Excel sheets, multiple tables)
@@ -116,20 +265,19 @@ def analyze_data(data_context: dict, task: str, max_retries: int = 3, tool_input
             for sub_name, sub_df in data.items():
                 if isinstance(sub_df, pd.DataFrame):
                     df_memory = sub_df.memory_usage(deep=True).sum() / (1024 * 1024)
-                    buffer = io.StringIO()
-                    sub_df.info(buf=buffer)
-                    df_info = buffer.getvalue()
-                    
-                    preview_rows = 10 if df_memory > 50 else 10  # Show at least 10 rows for better context
-                    
-                    context_preview += f"  DataFrame `{name}['{sub_name}']` (Memory: {df_memory:.1f}MB):\n"
-                    context_preview += f"  --- Head ({preview_rows} rows) ---\n{sub_df.head(preview_rows).to_markdown()}\n"
-                    context_preview += f"  --- Tail ({preview_rows} rows) ---\n{sub_df.tail(preview_rows).to_markdown()}\n"
-                    context_preview += f"  --- Info ---\n{df_info}\n"
+                    context_preview += f"  DataFrame `{name}['{sub_name}']` (Memory: {df_memory:.1f}MB, Shape: {sub_df.shape}):\n"
+                    context_preview += _frame_preview(sub_df)
                 else:
                     context_preview += f"  `{name}['{sub_name}']`: {type(sub_df)} (not a DataFrame)\n"
             context_preview += "---\n\n"
         
+        elif isinstance(data, pa.Table):
+            # Arrow table (e.g. straight from DuckDB): only the previewed rows are converted to pandas
+            table_memory = data.nbytes / (1024 * 1024)
+            context_preview += f"Arrow Table `{name}` (Memory: {table_memory:.1f}MB, Rows: {data.num_rows}):\n"
+            context_preview += f"schema:\n{data.schema}\n"
+            context_preview += f"sample:\n```\n{data.slice(0, 3).select(data.column_names[:8]).to_pandas().to_csv(index=False)}```\n---\n\n"
+        
         else:
             # Other data types
             context_preview += f"`{name}`: {type(data)} (not a DataFrame or dictionary)\n---\n\n"
@@ -167,9 +315,12 @@ You have been provided with:
    - For direct DataFrames: `data_context['step_name']` 
    - For dictionary collections: `data_context['step_name']['sheet_name']` or `data_context['step_name']['table_name']`
    - Check the DATA CONTEXT PREVIEW above to see the exact access pattern for each dataset
+   - Entries listed as `Arrow Table` are pyarrow Tables (`pa` is available); call `.to_pandas()` only when you need pandas APIs
 5.  If the MAIN TASK requires combining results from multiple DataFrames or previous steps, access and use ALL relevant DataFrames from the `data_context` dictionary.
 6.  Write a single, top-level Python script to perform all necessary cleaning, analysis, and visualization as required by the MAIN TASK.
 7.  **MEMORY OPTIMIZATION**: For large datasets (>50MB), use efficient operations like sampling, chunking, or vectorized operations. Avoid operations that duplicate large DataFrames unnecessarily.
+    For numeric reductions prefer the pre-compiled kernels `regr_slope(y, x)`, `pairwise_corr(a, b)` and `rolling_mean(a, window)` (they accept Series/arrays) over hand-written Python loops, and `clean_numeric_column(series)` to turn scraped text like '$1,234' or '12%' into floats.
+    For large DuckDB/S3 aggregations, `stream(sql, batch_size)` yields pyarrow RecordBatches; reduce them with `sum_batches(batches, column)` or collect them with `concat_batches(batches)` only when every row is needed (e.g. plotting).
 8.  The script must assign the final answer to a variable named `result`. The format of the `result` must match the MAIN TASK exactly.
 9.  **Default Output Format:** If the MAIN TASK does not specify a particular output format, return the result as a JSON array of strings (Python list of strings), where each string contains a clear, complete answer.
 10. Your entire output must be ONLY the raw Python code. Do not add explanations or markdown.
@@ -188,28 +339,26 @@ You have been provided with:
         try:
             logger.info(f"Executing Analysis Code:\n---START-CODE---\n{analysis_code}\n---END-CODE---")
 
-            local_vars = {
-                "data_context": data_context,
-                "pd": pd, "re": re, "plt": plt, "sns": sns,
-                "io": io, "base64": base64, "json": json,
-                "alt": alt, "stats": stats, "result": None
-            }
-
-            exec(analysis_code, local_vars)
-            final_result = local_vars.get("result")
+            if ANALYSIS_SANDBOX:
+                final_result = run_in_sandbox(_run_analysis_code, analysis_code, data_context, ANALYSIS_TIMEOUT_S)
+            else:
+                local_vars = _analysis_namespace(data_context)
+                exec(compile_code(analysis_code, '<analysis>'), local_vars)
+                final_result = local_vars.get("result")
 
             # --- Ensure all images are returned as base64 data URIs ---
             def to_base64_image(val):
-                import base64
+                import binascii
                 import io
+                # b2a_base64 encodes straight from a buffer view (no bytes copy, no trailing newline)
                 if hasattr(val, 'save') and callable(val.save):
                     # It's a PIL Image
                     buf = io.BytesIO()
                     val.save(buf, format='PNG')
-                    b64 = base64.b64encode(buf.getvalue()).decode('utf-8')
+                    b64 = binascii.b2a_base64(buf.getbuffer(), newline=False).decode('ascii')
                     return f"data:image/png;base64,{b64}"
                 if isinstance(val, (bytes, bytearray)):
-                    b64 = base64.b64encode(val).decode('utf-8')
+                    b64 = binascii.b2a_base64(memoryview(val), newline=False).decode('ascii')
                     return f"data:image/png;base64,{b64}"
                 return val
 
@@ -243,6 +392,7 @@ You have been provided with:
                         
                 if hasattr(final_result, 'item'):
                     return final_result.item()
+                # Only numpy scalars are converted; keys, tuples, NaN and datetimes are returned as they are
                 if isinstance(final_result, dict):
                     return {k: (v.item() if hasattr(v, 'item') else v) for k, v in final_result.items()}
                 if isinstance(final_result, list):
@@ -260,6 +410,9 @@ You have been provided with:
         except Exception as e:
             # --- THE FIX: Capture the full traceback for better debugging context ---
             error_log = traceback.format_exc()
+            if isinstance(e, SyntaxError):
+                # Put the exact position up front so the debugger prompt can fix it in one pass
+                error_log = f"SyntaxError at line {e.lineno}, column {e.offset}: {e.msg}\n{error_log}"
             logger.warning(f"⚠️ Analysis attempt {attempt + 1} failed:\n{error_log}")
             
             logger.debug(f"---FAILING-ANALYSIS-CODE---\n{analysis_code}\n---END-CODE---")
@@ -268,8 +421,13 @@ You have been provided with:
                 # Pass the original exception 'e' for a cleaner final error message to the user
                 raise RuntimeError(f"Failed to analyze data after {max_retries} attempts. Last error: {e}")
             
-            # On failure, call the expert debugger to get corrected code for the next attempt
-            analysis_code = _correct_analysis_code(analysis_code, error_log, task, context_preview)
+            # Try the local fixer first; only fall back to the expert debugger for errors it doesn't know
+            fixed_code = _local_fix(analysis_code, e, data_context)
+            if fixed_code is not None:
+                logger.info("🔧 Applied a local fix, retrying without an LLM correction.")
+                analysis_code = fixed_code
+            else:
+                analysis_code = _correct_analysis_code(analysis_code, error_log, task, context_preview)
 
     raise RuntimeError("Analysis failed after all retries.")
 
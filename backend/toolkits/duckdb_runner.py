@@ -1,38 +1,155 @@
 # backend/toolkits/duckdb_runner.py
 import duckdb
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import builtins
 import logging
+import os
 import re
 import textwrap
+import threading
 from backend.llm_agent import llm
+from ._code_extract import extract_python_code as _extract_python_code, compile_code
 
-# Import all libraries that the generated Python script might need
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
-import io
-import base64
-import json
-from scipy import stats
-from sklearn.linear_model import LinearRegression
-import numpy as np
 import traceback
 
 logger = logging.getLogger(__name__)
 
-def _extract_python_code(llm_response: str) -> str:
-    """Extracts Python code from an LLM response."""
-    match = re.search(r'```(?:python\n)?(.*)```', llm_response, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return llm_response.strip()
+# Shared in-memory connection; created lazily so importing this module stays offline-safe
+_CON = None
+_CON_LOCK = threading.Lock()
+
+def _get_connection() -> duckdb.DuckDBPyConnection:
+    """Returns the shared DuckDB connection, loading httpfs/parquet only on first use."""
+    global _CON
+    with _CON_LOCK:
+        if _CON is None:
+            con = duckdb.connect(database=':memory:')
+            try:
+                con.execute("INSTALL httpfs; LOAD httpfs; INSTALL parquet; LOAD parquet;")
+            except Exception as e:
+                logger.warning(f"⚠️ Could not preload DuckDB extensions: {e}")
+            con.execute(f"SET threads={os.cpu_count() or 1}")
+            _CON = con
+    return _CON
+
+def _fast_dedent(source: str) -> str:
+    """
+    Skips `textwrap.dedent` when the code already starts at column 0 (the usual case for
+    extracted LLM output) - dedent would be a no-op there but still copies the whole string.
+    """
+    if source[:1] and not source.startswith((' ', '\t')):
+        return source
+    return textwrap.dedent(source)
 
-def _generate_initial_script(task: str, full_task_context: str) -> str:
-    """Asks the LLM to generate an initial Python script for data retrieval."""
-    logger.info("🤖 Generating initial Python script for DuckDB task...")
+def _as_arrow_table(result) -> pa.Table:
+    """Newer DuckDB releases return a RecordBatchReader from `.arrow()`; older ones a Table."""
+    if isinstance(result, pa.RecordBatchReader):
+        return result.read_all()
+    return result
+
+def _arrow_to_pandas(result) -> pd.DataFrame:
+    # Columnar export + pyarrow conversion beats DuckDB's row-oriented pandas exporter on wide/large results.
+    # numpy-backed dtypes are kept (no ArrowDtype mapper) so downstream analysis code sees the usual frames.
+    return _as_arrow_table(result).to_pandas(split_blocks=True, self_destruct=True)
+
+class _FastRelation:
+    """Wraps a DuckDBPyRelation so `.df()` / `.to_df()` / `.fetchdf()` go through Arrow."""
+
+    def __init__(self, rel):
+        self._rel = rel
+
+    def df(self, *args, **kwargs) -> pd.DataFrame:
+        return _arrow_to_pandas(self._rel.arrow())
+
+    to_df = fetchdf = df
+
+    def __getattr__(self, name):
+        attr = getattr(self._rel, name)
+        if not callable(attr):
+            return attr
+        # Chained relation methods (filter, project, limit, ...) stay wrapped
+        def wrapped(*args, **kwargs):
+            out = attr(*args, **kwargs)
+            return _FastRelation(out) if isinstance(out, duckdb.DuckDBPyRelation) else out
+        return wrapped
+
+    def __repr__(self):
+        return repr(self._rel)
+
+class _FastConnection:
+    """Same idea for a connection/cursor: `con.sql(...).df()` and `con.execute(...).df()` both take the Arrow path."""
+
+    def __init__(self, con):
+        self._con = con
+
+    def sql(self, *args, **kwargs):
+        rel = self._con.sql(*args, **kwargs)
+        return _FastRelation(rel) if rel is not None else None
+
+    query = sql
+
+    def execute(self, *args, **kwargs):
+        self._con.execute(*args, **kwargs)
+        return self
+
+    def df(self, *args, **kwargs) -> pd.DataFrame:
+        return _arrow_to_pandas(self._con.arrow())
+
+    fetchdf = fetch_df = df
+
+    def cursor(self):
+        return _FastConnection(self._con.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self._con.__exit__(*exc)
+
+class _FastDuckDB:
+    """
+    Stand-in for the `duckdb` module inside generated scripts. Module-level `duckdb.sql(...)`
+    runs on the script's shared cursor (extensions already loaded) and every `.df()` goes
+    through Arrow; anything else falls through to the real module.
+    """
+
+    def __init__(self, con: _FastConnection):
+        self._con = con
+
+    def connect(self, *args, **kwargs) -> _FastConnection:
+        return _FastConnection(duckdb.connect(*args, **kwargs))
+
+    def sql(self, *args, **kwargs):
+        return self._con.sql(*args, **kwargs)
+
+    query = sql
+
+    def execute(self, *args, **kwargs):
+        return self._con.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(duckdb, name)
+
+def _script_builtins(fast_duckdb: _FastDuckDB) -> dict:
+    """Builtins for the retrieval script where `import duckdb` resolves to the wrapper instead of the real module."""
+    real_import = builtins.__import__
+
+    def _import(name, globals=None, locals=None, fromlist=(), level=0):
+        if name == 'duckdb' and not fromlist and level == 0:
+            return fast_duckdb
+        return real_import(name, globals, locals, fromlist, level)
+
+    return {**builtins.__dict__, '__import__': _import}
+
+def _initial_script_prompt(task: str, full_task_context: str) -> str:
+    """Builds the prompt asking for an initial data retrieval script."""
     # MODIFICATION: The prompt is now focused solely on data retrieval.
-    prompt = f"""
+    return f"""
 You are a Data Engineer. Your goal is to write a Python script that uses the DuckDB library to query a large dataset on S3 and return the result as a pandas DataFrame.
 
 **Full User Task (for context, schema, and paths):**
@@ -46,21 +163,19 @@ You are a Data Engineer. Your goal is to write a Python script that uses the Duc
 ---
 
 **Instructions:**
-- Write a Python script that connects to DuckDB, runs a single SQL query to fetch the data for the specific task, and returns the result as a pandas DataFrame.
-- The script MUST assign the final pandas DataFrame to a variable named `result`.
+- Write a Python script that runs a single SQL query with DuckDB to fetch the data for the specific task, and returns the result as a pandas DataFrame.
+- A DuckDB connection named `con` is already available with the httpfs and parquet extensions loaded. Use `con.sql(...)` / `con.execute(...)` instead of calling `duckdb.connect()` or running INSTALL/LOAD.
+- The script MUST assign the query result to a variable named `result`. Prefer `result = con.sql(query).arrow()` (a pyarrow Table, which avoids an extra pandas copy); a pandas DataFrame is also accepted.
 - DO NOT perform any analysis, calculations, or plotting in this script.
 - Return ONLY the raw Python code.
 
 **Your Python Script:**
 """
-    raw_script = llm(prompt).strip()
-    return _extract_python_code(raw_script)
 
-def _correct_python_script(failed_script: str, error_message: str, task: str, full_task_context: str) -> str:
-    """Asks the LLM to correct a failed Python script based on the error message."""
-    logger.info("🤖 Attempting to correct failed Python script...")
+def _correction_prompt(failed_script: str, error_message: str, task: str, full_task_context: str) -> str:
+    """Builds the prompt asking the LLM to fix a failed retrieval script."""
     # MODIFICATION: The correction prompt is also focused on returning a DataFrame.
-    prompt = f"""
+    return f"""
 You are a Senior Python Data Scientist acting as an expert code debugger.
 The following Python script failed to execute. Your task is to analyze the error and provide a corrected version.
 
@@ -87,56 +202,122 @@ The following Python script failed to execute. Your task is to analyze the error
 **Instructions:**
 - Carefully analyze the error traceback and the failed code.
 - The corrected script's only goal is to retrieve data from DuckDB.
-- The script MUST assign the final pandas DataFrame to a variable named `result`.
+- A DuckDB connection named `con` is already available with the httpfs and parquet extensions loaded. Use it instead of calling `duckdb.connect()`.
+- The script MUST assign the query result (a pyarrow Table via `.arrow()`, or a pandas DataFrame) to a variable named `result`.
 - Return ONLY the raw, corrected Python script.
 
 **Corrected Script:**
 """
-    raw_corrected_script = llm(prompt).strip()
+
+def _generate_initial_script(task: str, full_task_context: str) -> str:
+    """Asks the LLM to generate an initial Python script for data retrieval."""
+    logger.info("🤖 Generating initial Python script for DuckDB task...")
+    raw_script = llm(_initial_script_prompt(task, full_task_context)).strip()
+    return _extract_python_code(raw_script)
+
+def _correct_python_script(failed_script: str, error_message: str, task: str, full_task_context: str) -> str:
+    """Asks the LLM to correct a failed Python script based on the error message."""
+    logger.info("🤖 Attempting to correct failed Python script...")
+    raw_corrected_script = llm(_correction_prompt(failed_script, error_message, task, full_task_context)).strip()
     return _extract_python_code(raw_corrected_script)
 
-# MODIFICATION: Renamed the function to reflect its specific purpose.
-def retrieve_data_as_df(task: str, full_task_context: str, max_retries: int = 3) -> pd.DataFrame:
+def _run_retrieval_script(task: str, full_task_context: str, max_retries: int):
     """
-    This is the main function called by the agent.
-    It generates and executes a Python script to retrieve data from DuckDB,
-    with a self-correction loop, and returns a pandas DataFrame.
+    Generates and executes the retrieval script with a self-correction loop.
+    Returns whatever tabular object the script produced (pyarrow Table or pandas DataFrame).
     """
     initial_script = _generate_initial_script(task, full_task_context)
     
-    current_script = textwrap.dedent(initial_script)
+    current_script = _fast_dedent(initial_script)
     for attempt in range(max_retries):
         try:
             logger.info(f"Python script attempt {attempt + 1} of {max_retries}...")
             logger.info(f"Executing Python Script:\n---START-SCRIPT---\n{current_script}\n---END-SCRIPT---")
 
+            # A fresh cursor per attempt shares the warmed-up connection without sharing its state;
+            # both `con` and `duckdb` are wrapped so the script's `.df()` calls use the Arrow export
+            con = _FastConnection(_get_connection().cursor())
+            fast_duckdb = _FastDuckDB(con)
             local_vars = {
-                "duckdb": duckdb, "pd": pd, "re": re,
+                "__builtins__": _script_builtins(fast_duckdb),
+                "duckdb": fast_duckdb, "con": con, "pd": pd, "re": re,
                 "result": None
             }
 
-            exec(current_script, local_vars)
+            exec(compile_code(current_script, '<retrieval>'), local_vars)
             final_result = local_vars.get("result")
-
-            # MODIFICATION: The tool now strictly expects a pandas DataFrame as the result.
-            if isinstance(final_result, pd.DataFrame):
-                logger.info("✅ Script executed successfully and returned a DataFrame.")
+            if isinstance(final_result, pa.RecordBatchReader):
+                final_result = final_result.read_all()
+            elif isinstance(final_result, _FastRelation):
+                final_result = _as_arrow_table(final_result.arrow())
+
+            # The tool expects tabular data: an Arrow table straight from DuckDB, or a pandas DataFrame.
+            if isinstance(final_result, (pa.Table, pd.DataFrame)):
+                logger.info(f"✅ Script executed successfully and returned a {type(final_result).__name__}.")
                 return final_result
             else:
-                raise ValueError(f"Script did not return a pandas DataFrame. Got type: {type(final_result)}")
+                raise ValueError(f"Script did not return a pyarrow Table or pandas DataFrame. Got type: {type(final_result)}")
 
         except Exception as e:
             error_log = traceback.format_exc()
+            if isinstance(e, SyntaxError):
+                # Put the exact position up front so the debugger prompt can fix it in one pass
+                error_log = f"SyntaxError at line {e.lineno}, column {e.offset}: {e.msg}\n{error_log}"
             logger.warning(f"⚠️ Script failed on attempt {attempt + 1}:\n{error_log}")
             
             if attempt + 1 == max_retries:
                 logger.error("❌ All script execution attempts failed.")
                 raise RuntimeError(f"Script failed after {max_retries} attempts. Last error: {e}")
             
-            current_script = _correct_python_script(current_script, error_log, task, full_task_context)
+            current_script = _fast_dedent(_correct_python_script(current_script, error_log, task, full_task_context))
     
     raise RuntimeError("DuckDB tool failed to execute after all retries.")
 
+def execute_query_streaming(query: str, batch_size: int = 65536):
+    """
+    Runs a SQL query on the shared connection and yields `pyarrow.RecordBatch` objects
+    of at most `batch_size` rows, so reductions never hold the full result in memory.
+    """
+    reader = _get_connection().cursor().sql(query).fetch_record_batch(batch_size)
+    for batch in reader:
+        yield batch
+
+def sum_batches(batches, column: str):
+    """Sums one column across a stream of record batches."""
+    total = 0
+    for batch in batches:
+        value = pc.sum(batch.column(column)).as_py()
+        if value is not None:
+            total += value
+    return total
+
+def concat_batches(batches) -> pa.Table:
+    """Collects a stream of record batches into a single Arrow table."""
+    return pa.Table.from_batches(list(batches))
+
+def retrieve_data_as_arrow(task: str, full_task_context: str, max_retries: int = 3) -> pa.Table:
+    """
+    This is the main function called by the agent.
+    Same as `retrieve_data_as_df`, but keeps DuckDB's columnar result as a pyarrow Table
+    so callers that re-serialize or only touch a few columns never pay for a pandas copy.
+    """
+    result = _run_retrieval_script(task, full_task_context, max_retries)
+    if isinstance(result, pd.DataFrame):
+        return pa.Table.from_pandas(result, preserve_index=False)
+    return result
+
+# MODIFICATION: Renamed the function to reflect its specific purpose.
+def retrieve_data_as_df(task: str, full_task_context: str, max_retries: int = 3) -> pd.DataFrame:
+    """
+    Generates and executes a Python script to retrieve data from DuckDB,
+    with a self-correction loop, and returns a pandas DataFrame.
+    """
+    result = _run_retrieval_script(task, full_task_context, max_retries)
+    if isinstance(result, pa.Table):
+        # Convert only at the pandas boundary; self_destruct frees Arrow buffers as columns are converted
+        return result.to_pandas(split_blocks=True, self_destruct=True)
+    return result
+
 
 
 
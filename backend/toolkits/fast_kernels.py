@@ -0,0 +1,229 @@
+# backend/toolkits/fast_kernels.py
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Pre-compiled numeric kernels exposed to LLM-generated analysis code, so common reductions
+# run as native loops instead of interpreted Python. If numba is not installed the same
+# functions fall back to vectorized NumPy, so callers never need to care which one they get.
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+    prange = range
+
+
+if HAS_NUMBA:
+    # Compiled on first call rather than at import, so importing this module stays cheap for code that
+    # never calls a kernel. Sandbox workers start from a forkserver and inherit nothing compiled from
+    # the parent, so each one loads the kernels it uses from the cache=True on-disk cache.
+    @njit(parallel=True, cache=True)
+    def _regr_slope_kernel(y, x):
+        n = x.shape[0]
+        sx = 0.0
+        sy = 0.0
+        for i in prange(n):
+            sx += x[i]
+            sy += y[i]
+        mx = sx / n
+        my = sy / n
+        sxy = 0.0
+        sxx = 0.0
+        for i in prange(n):
+            dx = x[i] - mx
+            sxy += dx * (y[i] - my)
+            sxx += dx * dx
+        return sxy / sxx
+
+    @njit(cache=True)
+    def _pairwise_corr_kernel(a, b):
+        n = a.shape[0]
+        ma = a.mean()
+        mb = b.mean()
+        sab = 0.0
+        saa = 0.0
+        sbb = 0.0
+        for i in range(n):
+            da = a[i] - ma
+            db = b[i] - mb
+            sab += da * db
+            saa += da * da
+            sbb += db * db
+        return sab / np.sqrt(saa * sbb)
+
+    @njit(cache=True)
+    def _rolling_mean_kernel(a, w):
+        # NaNs are counted instead of summed, so one missing value only blanks the windows that contain it
+        n = a.shape[0]
+        out = np.full(n, np.nan)
+        running = 0.0
+        missing = 0
+        for i in range(n):
+            v = a[i]
+            if v != v:
+                missing += 1
+            else:
+                running += v
+            if i >= w:
+                old = a[i - w]
+                if old != old:
+                    missing -= 1
+                else:
+                    running -= old
+            if i >= w - 1 and missing == 0:
+                out[i] = running / w
+        return out
+
+else:
+    def _regr_slope_kernel(y, x):
+        dx = x - x.mean()
+        return float((dx * (y - y.mean())).sum() / (dx * dx).sum())
+
+    def _pairwise_corr_kernel(a, b):
+        return float(np.corrcoef(a, b)[0, 1])
+
+    def _rolling_mean_kernel(a, w):
+        out = np.full(a.shape[0], np.nan)
+        if a.shape[0] >= w:
+            missing = np.isnan(a)
+            csum = np.cumsum(np.concatenate(([0.0], np.where(missing, 0.0, a))))
+            cmissing = np.cumsum(np.concatenate(([0], missing)))
+            means = (csum[w:] - csum[:-w]) / w
+            means[cmissing[w:] - cmissing[:-w] > 0] = np.nan
+            out[w - 1:] = means
+        return out
+
+
+def _parse_numeric_rows(buf):
+    """
+    Character-level number parser over a (rows, width) uint8 matrix of UTF-8 cells.
+    Skips currency/labels before the first digit, ignores thousands separators and stops at the first
+    other character after the digits (so '1,234[1]' -> 1234, '12%' -> 12). A '-' or U+2212 is a minus
+    sign only as the cell's first non-space character or directly before the number ('-$5', '$-5'), and
+    a leading '(' marks an accounting negative; a dash inside a label ('Rank - 5') is not a sign.
+    Cells without digits become NaN.
+    """
+    n, w = buf.shape
+    out = np.empty(n)
+    for i in prange(n):
+        neg = False
+        leading = True  # only spaces seen so far
+        lead_neg = False  # sign came from the start of the cell and survives a currency prefix
+        started = False
+        seen_dot = False
+        value = 0.0
+        scale = 1.0
+        j = 0
+        while j < w:
+            c = buf[i, j]
+            if c == 0:
+                break
+            if 48 <= c <= 57:
+                started = True
+                if seen_dot:
+                    scale /= 10.0
+                    value += (c - 48) * scale
+                else:
+                    value = value * 10.0 + (c - 48)
+            elif c == 44:  # ','
+                pass
+            elif c == 46:  # '.'
+                if seen_dot and started:
+                    break
+                seen_dot = True
+            elif not started:
+                seen_dot = False
+                minus = c == 45
+                if c == 0xE2 and j + 2 < w and buf[i, j + 1] == 0x88 and buf[i, j + 2] == 0x92:
+                    minus = True  # U+2212 minus sign
+                    j += 2
+                if c == 32 and leading:
+                    pass
+                elif (minus or c == 40) and leading:  # leading '-' or accounting '('
+                    neg = True
+                    lead_neg = True
+                    leading = False
+                elif minus:
+                    neg = True  # kept only if the number follows immediately
+                    leading = False
+                else:
+                    neg = lead_neg
+                    leading = False
+            else:
+                break
+            j += 1
+        if started:
+            out[i] = -value if neg else value
+        else:
+            out[i] = np.nan
+    return out
+
+if HAS_NUMBA:
+    _parse_numeric_kernel = njit(parallel=True, cache=True)(_parse_numeric_rows)
+else:
+    _parse_numeric_kernel = _parse_numeric_rows
+
+def _paired(a, b):
+    """Float64 contiguous copies of two equal-length inputs with NaN pairs dropped (SQL NULL semantics)."""
+    a = np.ascontiguousarray(a, dtype=np.float64)
+    b = np.ascontiguousarray(b, dtype=np.float64)
+    mask = ~(np.isnan(a) | np.isnan(b))
+    if not mask.all():
+        a, b = a[mask], b[mask]
+    return a, b
+
+
+def regr_slope(y, x) -> float:
+    """Least-squares slope of y on x, like DuckDB's `regr_slope(y, x)`. NaN pairs are ignored."""
+    y, x = _paired(y, x)
+    if x.shape[0] < 2:
+        return float('nan')
+    return float(_regr_slope_kernel(y, x))
+
+
+def pairwise_corr(a, b) -> float:
+    """Pearson correlation of two equal-length sequences. NaN pairs are ignored."""
+    a, b = _paired(a, b)
+    if a.shape[0] < 2:
+        return float('nan')
+    return float(_pairwise_corr_kernel(a, b))
+
+
+def rolling_mean(a, w: int) -> np.ndarray:
+    """
+    Trailing rolling mean with window `w`, like pandas `rolling(w).mean()`: the first `w - 1` positions
+    and every window containing a NaN are NaN.
+    """
+    w = int(w)
+    if w < 1:
+        raise ValueError(f"rolling_mean window must be >= 1, got {w}")
+    a = np.ascontiguousarray(a, dtype=np.float64)
+    return _rolling_mean_kernel(a, w)
+
+
+def clean_numeric_column(series) -> "pd.Series":
+    """
+    Coerces scraped text like '$1,234', '(56)', '12.5%' or '3,000[2]' to float64 in one native pass,
+    instead of chaining `.str.replace(...)` calls before `astype(float)`. Returns a Series on the same index.
+    """
+    import pandas as pd
+    series = series if isinstance(series, pd.Series) else pd.Series(series)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(np.float64)
+    values = series.astype(str).to_numpy(dtype=object).astype(str)
+    encoded = np.char.encode(values, 'utf-8') if len(values) else np.array([], dtype='S1')
+    width = max(encoded.dtype.itemsize, 1)
+    buf = np.ascontiguousarray(encoded).view(np.uint8).reshape(len(values), width)
+    return pd.Series(_parse_numeric_kernel(buf), index=series.index, name=series.name)
+
+
+# Names registered into the analysis sandbox
+KERNELS = {
+    "regr_slope": regr_slope,
+    "pairwise_corr": pairwise_corr,
+    "rolling_mean": rolling_mean,
+    "clean_numeric_column": clean_numeric_column,
+}
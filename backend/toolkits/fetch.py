@@ -1,38 +1,319 @@
 # backend/toolkits/fetch.py
 
+import numpy as np
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from backend.llm_agent import llm
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+from lxml import etree
+from pandas.io.parsers import TextParser
+from backend.llm_agent import llm, cached_llm, cache_put, get_embedder, llm_many, correction_variants
+from ._code_extract import extract_python_code, compile_code, auto_repair
+from .fast_kernels import clean_numeric_column
 import re
+import hashlib
 import logging
-from io import StringIO # Required for pandas.read_html from string
+import sqlite3
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO # Lets pandas.read_html/lxml consume the raw response bytes and table fragments
 
 logger = logging.getLogger(__name__)
 
-def extract_python_code(llm_response: str) -> str:
-    """Extracts Python code from an LLM response."""
-    match = re.search(r'```(?:python\n)?(.*)```', llm_response, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return llm_response.strip()
+# Compressed transfer: urllib3 only decodes brotli when a brotli package is installed, so only advertise it then
+try:
+    import brotli  # noqa: F401
+    _ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        _ACCEPT_ENCODING = 'gzip, deflate, br'
+    except ImportError:
+        _ACCEPT_ENCODING = 'gzip, deflate'
+
+_INT_RE = re.compile(r'\d+')  # table index in the selection reply
+
+_UA_HEADERS = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': _ACCEPT_ENCODING}
+
+# One pooled session for the whole process so repeated fetches reuse TCP/TLS connections.
+# Responses are cached in SQLite; the server's Cache-Control/Expires win when present, otherwise
+# an hour. Once stale, the stored ETag/Last-Modified are sent back so an unchanged page comes
+# back as a cheap 304 and a fresh hit (`response.from_cache`) opens no socket at all.
+# Created on first fetch so importing this module doesn't create the SQLite file.
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def _get_session() -> requests_cache.CachedSession:
+    """Returns the shared cached, pooled HTTP session, creating it on first use."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests_cache.CachedSession(
+                '.http_cache',
+                backend='sqlite',
+                cache_control=True,
+                expire_after=3600,
+                allowable_methods=['GET'],
+                stale_if_error=True,
+            )
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.3))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _SESSION = session
+    return _SESSION
+
+# Table-bearing tags kept when parsing with a SoupStrainer
+_TABLE_TAGS = ['table', 'caption', 'thead', 'tbody']
+
+# A <meta charset> / http-equiv declaration near the top of the page, which lxml honours on its own
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset', re.IGNORECASE)
+
+def _response_encoding(response):
+    """
+    The charset to decode the raw body with, as `response.text` would: the Content-Type charset when
+    the server sends one, otherwise None if the page declares its own (lxml reads the <meta>), and
+    only then the detected `apparent_encoding`.
+    """
+    if 'charset' in response.headers.get('Content-Type', '').lower():
+        return response.encoding
+    if _META_CHARSET_RE.search(response.content[:4096]):
+        return None
+    return response.apparent_encoding
+
+def _parse_html(content: bytes, encoding: str = None) -> BeautifulSoup:
+    """
+    Parses only the table subtrees with lxml; falls back to the full document
+    when the page has no tables so the LLM still gets broader context.
+    """
+    soup = BeautifulSoup(content, 'lxml', parse_only=SoupStrainer(_TABLE_TAGS), from_encoding=encoding)
+    if soup.find('table'):
+        return soup
+    logger.info("No tables found by the table-only parser, parsing the full document.")
+    return BeautifulSoup(content, 'lxml', from_encoding=encoding)
+
+# Tables smaller than this are navigation/infobox chrome and are never worth parsing or showing the LLM
+_MIN_TABLE_ROWS = 3
+_MIN_TABLE_CELLS = 10
+
+# colspan/rowspan are clamped to this; crafted huge spans otherwise expand into millions of cells
+_MAX_SPAN = 1000
+# Spans of 4+ digits in raw markup; read_html expands spans literally, so these are rewritten before it sees them.
+# The probe has a literal prefix (fast scan) and runs on a lowercased copy; the rewrite only runs when it hits.
+_HUGE_SPAN_PROBE = re.compile(rb'''span\s*=\s*["']?\d{4}''')
+_HUGE_SPAN_RE = re.compile(rb'''((?:col|row)span\s*=\s*["']?)(\d{4,})''', re.IGNORECASE)
+
+def _clamp_spans(html: bytes) -> bytes:
+    """Rewrites any colspan/rowspan above _MAX_SPAN in raw HTML to _MAX_SPAN; returns `html` itself when there are none."""
+    if _HUGE_SPAN_PROBE.search(html.lower()) is None:
+        return html
+    return _HUGE_SPAN_RE.sub(lambda m: m.group(1) + str(min(int(m.group(2)), _MAX_SPAN)).encode(), html)
+
+def _span(value) -> int:
+    try:
+        return min(max(int(value), 1), _MAX_SPAN)
+    except (TypeError, ValueError):
+        return 1
+
+_STYLE_WS_RE = re.compile(r'\s+')
+
+def _is_hidden(element) -> bool:
+    style = (element.get('style') or '').lower()
+    return 'none' in style and 'display:none' in _STYLE_WS_RE.sub('', style)
+
+def _drop_hidden(table):
+    """
+    Removes <style> blocks and display:none descendants (keeping their tail text), matching
+    `read_html(displayed_only=True)`.
+    """
+    for element in table.xpath('.//style|.//*[@style]'):
+        parent = element.getparent()
+        if parent is None or (element.tag != 'style' and not _is_hidden(element)):
+            continue
+        if element.tail:
+            previous = element.getprevious()
+            if previous is not None:
+                previous.tail = (previous.tail or '') + element.tail
+            else:
+                parent.text = (parent.text or '') + element.tail
+        parent.remove(element)
+
+# read_html's cell whitespace rule: line breaks and runs of 2+ whitespace become one space
+_CELL_WS_RE = re.compile(r'[\r\n]+|\s{2,}')
+
+def _cell_text(cell) -> str:
+    """Cell text normalised like `read_html`: <br> is a line break, then whitespace is collapsed."""
+    for br in cell.iter('br'):
+        br.tail = '\n' + (br.tail or '')
+    return _CELL_WS_RE.sub(' ', ''.join(cell.itertext()).strip())
+
+def _table_to_frame(table):
+    """
+    Walks one <table> element with XPath and builds the DataFrame in a single pass.
+    Rows are collected as plain lists, spans are expanded (clamped), and typing goes through the
+    same TextParser `read_html` uses (e.g. "1,234" -> int). Returns None for layouts this walk
+    doesn't model (multi-row headers), so the caller can hand that table to `read_html`.
+    """
+    rows, header_rows = [], 0
+    pending = {}  # column index -> [rows still spanned, text] for cells with rowspan > 1
+    for tr in table.xpath('./tr|./thead/tr|./tbody/tr|./tfoot/tr'):
+        cells = tr.xpath('./td|./th')
+        if not cells:
+            continue
+        row = []
+
+        def fill_spanned():
+            while len(row) in pending:
+                carried = pending[len(row)]
+                row.append(carried[1])
+                carried[0] -= 1
+                if carried[0] == 0:
+                    del pending[len(row) - 1]
+
+        for cell in cells:
+            fill_spanned()
+            text = _cell_text(cell)
+            rowspan = _span(cell.get('rowspan'))
+            for _ in range(_span(cell.get('colspan'))):
+                if rowspan > 1:
+                    pending[len(row)] = [rowspan - 1, text]
+                row.append(text)
+        fill_spanned()
+
+        in_thead = tr.getparent().tag == 'thead'
+        if not rows or header_rows == len(rows):
+            if in_thead or all(cell.tag == 'th' for cell in cells):
+                header_rows += 1
+        rows.append(row)
+
+    if header_rows > 1 or len(rows) <= header_rows:
+        return None
+    width = max(len(r) for r in rows)
+    rows = [r + [None] * (width - len(r)) for r in rows]
+    frame = TextParser(rows, header=0 if header_rows else None, thousands=',').read()
+    return frame
+
+def _iter_table_elements(content: bytes, encoding: str = None, chunk_size: int = 65536):
+    """
+    Yields each <table> element as soon as its closing tag has been parsed. The body is fed to the
+    pull parser in slices, so converted tables can be cleared before the rest of the page is parsed.
+    """
+    parser = etree.HTMLPullParser(events=('end',), tag='table', encoding=encoding)
+    view = memoryview(content)
+    for start in range(0, len(view), chunk_size):
+        parser.feed(view[start:start + chunk_size].tobytes())
+        for _, table in parser.read_events():
+            yield table
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        return  # empty body
+    for _, table in parser.read_events():
+        yield table
+
+def _read_candidate_tables(content: bytes, encoding: str = None) -> list:
+    """
+    Parses only the tables that pass the size heuristic, straight from the lxml tree (no per-cell
+    pandas conversion loop); `read_html` is kept as the per-table fallback.
+    Returns an empty list when no table qualifies so the caller can fall back to the whole page.
+    """
+    tables = []
+    for table in _iter_table_elements(content, encoding):
+        if _is_hidden(table) or any(_is_hidden(a) for a in table.iterancestors()):
+            continue
+        _drop_hidden(table)
+        if len(table.xpath('.//tr')) < _MIN_TABLE_ROWS or len(table.xpath('.//td|.//th')) < _MIN_TABLE_CELLS:
+            continue
+        try:
+            frame = _table_to_frame(table)
+            if frame is None:
+                frame = pd.read_html(BytesIO(_clamp_spans(etree.tostring(table))), flavor='lxml')[0]
+            tables.append(frame)
+        except (ValueError, IndexError):
+            continue
+        finally:
+            # A converted top-level table is no longer needed; drop its subtree to keep the tree small
+            if next(table.iterancestors('table'), None) is None:
+                table.clear()
+    return tables
+
+# Table selection tries a local sentence-embedding model (optional) before asking the LLM
+_EMBED_MIN_SCORE = 0.4  # below this even the best table is only loosely related to the task
+_EMBED_TIE_MARGIN = 0.02
+
+def _select_table_by_embedding(tables: list, task_description: str):
+    """
+    Picks the table whose header + first row is most similar to the task.
+    Returns None (so the caller asks the LLM) if no model is available, the best match is weak,
+    or the top two are too close to call.
+    """
+    embedder = get_embedder()
+    if embedder is None:
+        return None
+    previews = [
+        " | ".join(df.columns.astype(str)) + " " + (" ".join(df.iloc[0].astype(str)) if len(df) else "")
+        for df in tables
+    ]
+    task_vec = embedder.encode(task_description, normalize_embeddings=True)
+    table_vecs = embedder.encode(previews, normalize_embeddings=True, batch_size=32)
+    scores = table_vecs @ task_vec
+    ranked = np.argsort(scores)[::-1]
+    if scores[ranked[0]] < _EMBED_MIN_SCORE:
+        logger.info(f"Best embedding score {scores[ranked[0]]:.3f} is below {_EMBED_MIN_SCORE}, deferring to the LLM.")
+        return None
+    if scores[ranked[0]] - scores[ranked[1]] < _EMBED_TIE_MARGIN:
+        logger.info(f"Embedding scores too close ({scores[ranked[0]]:.3f} vs {scores[ranked[1]]:.3f}), deferring to the LLM.")
+        return None
+    return int(ranked[0])
+
+def _html_snippet(soup: BeautifulSoup, limit: int) -> str:
+    """
+    Prettify-style preview of the first `limit` characters, built by walking the tree until
+    the cap is hit instead of serializing (and pretty-printing) the whole document first.
+    """
+    pieces, size = [], 0
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            attrs = ''.join(
+                f' {k}="{" ".join(v) if isinstance(v, list) else v}"' for k, v in node.attrs.items()
+            )
+            piece = f"<{node.name}{attrs}>"
+        else:
+            piece = str(node).strip()
+            if not piece:
+                continue
+        pieces.append(piece)
+        size += len(piece) + 1
+        if size >= limit:
+            break
+    return '\n'.join(pieces)[:limit]
+
+def _table_preview(df: pd.DataFrame) -> str:
+    """Compact CSV preview for the table-selection prompt (3 rows, 8 columns is enough to pick a table)."""
+    table_info = f"Shape: {df.shape}"
+    column_names = f"Columns: {list(df.columns)[:10]}"  # Max 10 columns
+    table_preview = df.iloc[:3, :8].to_csv(index=False)
+    return f"{table_info} | {column_names}\nPreview:\n```\n{table_preview[:500]}```"
+
+_STRUCT_TAGS = ['header', 'nav', 'main', 'section', 'article', 'div', 'table']
+
+def _scraping_prompt(soup: BeautifulSoup, task_description: str, previous_error: str = "") -> str:
+    """Builds the manual-scraping prompt from a compact summary of the page structure."""
+    # One pass over the tree collects the first 3 of each structural tag and every table
+    per_tag = {tag: [] for tag in _STRUCT_TAGS}
+    tables = []
+    for elem in soup.find_all(True):
+        name = elem.name
+        if name == 'table':
+            tables.append(elem)
+        if name in per_tag and len(per_tag[name]) < 3:  # Only first 3 of each
+            per_tag[name].append(elem)
 
-def llm_generate_scraping_code(soup: BeautifulSoup, task_description: str, previous_error: str = "") -> str:
-    """Generates scraping code as a fallback."""
-    logger.info("🤖 Falling back to LLM code generation for scraping...")
-    
-    import traceback
-    
-    # Extract key HTML structure elements for context
-    html_text = str(soup)
-    
     # Extract key structural elements (much smaller context)
     key_elements = []
-    
-    # Get main structural tags
-    for tag in ['header', 'nav', 'main', 'section', 'article', 'div', 'table']:
-        elements = soup.find_all(tag, limit=3)  # Only first 3 of each
-        for elem in elements:
+    for tag in _STRUCT_TAGS:
+        for elem in per_tag[tag]:
             if elem.get('class') or elem.get('id'):
                 key_elements.append(f"<{tag} class='{elem.get('class')}' id='{elem.get('id')}'>")
     
@@ -41,25 +322,24 @@ def llm_generate_scraping_code(soup: BeautifulSoup, task_description: str, previ
     
     # Enhanced table detection and context (limited)
     table_context = ""
-    tables = soup.find_all('table')
     if tables:
         table_context = f"\n\nTABLES FOUND: {len(tables)} table(s)\n"
         # Only show info for first 2 tables to keep prompt small
         for i, table in enumerate(tables[:2]):
+            trs = table.find_all('tr')  # one row scan per table, reused below
             # Get table headers (limit to 10)
             headers = []
-            header_row = table.find('tr')
-            if header_row:
-                headers = [th.get_text(strip=True) for th in header_row.find_all(['th', 'td'])[:10]]
+            if trs:
+                headers = [th.get_text(strip=True) for th in trs[0].find_all(['th', 'td'], limit=10)]
             
             # Get just 1 sample row
-            rows = table.find_all('tr')[1:2]  # Only 1 sample row
+            rows = trs[1:2]  # Only 1 sample row
             sample_data = []
             for row in rows:
                 cells = [td.get_text(strip=True)[:20] for td in row.find_all(['td', 'th'])[:10]]  # Truncate cell content
                 sample_data.append(cells)
             
-            table_context += f"Table {i+1}: Headers={headers[:5]}, Sample={sample_data}, Rows≈{len(table.find_all('tr'))}\n"
+            table_context += f"Table {i+1}: Headers={headers[:5]}, Sample={sample_data}, Rows≈{len(trs)}\n"
     
     # Truncate error context to essential info only
     error_context = ""
@@ -79,23 +359,98 @@ WEBSITE STRUCTURE:
 {table_context}
 
 BASIC HTML PREVIEW (first 800 chars):
-{soup.prettify()[:800]}
+{_html_snippet(soup, 800)}
 {error_context}
 
 INSTRUCTIONS:
 1. Analyze the HTML structure to understand the layout
 2. Write Python code using BeautifulSoup and pandas
-3. Use the pre-populated `soup` variable
+3. Use the pre-populated `soup` variable (already parsed with lxml); never re-parse the page, e.g. with `BeautifulSoup(str(soup), 'html.parser')`
 4. Extract data matching the TASK exactly
 5. Assign final DataFrame to variable named `result`
-6. Handle data cleaning and validation
+6. Handle data cleaning and validation; for numeric text columns ('$1,234', '12%', '3,000[2]') use the pre-loaded `clean_numeric_column(series)` instead of chained `.str.replace(...)` calls
 7. **Output ONLY raw Python code**
 
 VALIDATION: Ensure DataFrame is relevant to task, has proper columns, and contains meaningful data.
 """
-    raw_code = llm(prompt)
+    return prompt
+
+def llm_generate_scraping_code(soup: BeautifulSoup, task_description: str, previous_error: str = "") -> str:
+    """Generates scraping code as a fallback."""
+    logger.info("🤖 Falling back to LLM code generation for scraping...")
+    prompt = _scraping_prompt(soup, task_description, previous_error)
+    # A retry after an error skips the cache so it can't get the same broken code back. Misses aren't
+    # stored here; extract_relevant_data stores the code under this prompt once it has run.
+    raw_code = llm(prompt) if previous_error else cached_llm(prompt, namespace="scrape_gen", store=False)
     return extract_python_code(raw_code)
 
+def _scraping_code_candidates(soup: BeautifulSoup, task_description: str, previous_error: str) -> list:
+    """After a failure, asks for several differently-phrased fixes at once (run in order by the caller)."""
+    logger.info("🤖 Requesting scraping code candidates after failure...")
+    prompts = correction_variants(_scraping_prompt(soup, task_description, previous_error))
+    candidates = []
+    # Uncached: an earlier answer to this exact correction prompt is the code that just failed again
+    for raw_code in llm_many(prompts, call=llm):
+        code = extract_python_code(raw_code)
+        if code and code not in candidates:
+            candidates.append(code)
+    return candidates
+
+def _scrape_namespace(soup: BeautifulSoup) -> dict:
+    """Names the generated scraping code runs with."""
+    return {"soup": soup, "pd": pd, "clean_numeric_column": clean_numeric_column, "result": None}
+
+def _run_scraping_code(scraping_code: str, soup: BeautifulSoup) -> pd.DataFrame:
+    """Executes generated scraping code and validates its `result`; raises on any failure."""
+    local_vars = _scrape_namespace(soup)
+    exec(compile_code(scraping_code, '<scrape>'), {}, local_vars)
+    df = local_vars.get("result")
+    
+    # Validate that the result is appropriate for the task
+    if isinstance(df, pd.DataFrame) and not df.empty:
+        # Check if the scraped data is relevant to the task
+        logger.info(f"✅ Generated DataFrame with shape {df.shape}")
+        logger.info(f"DataFrame columns: {list(df.columns)}")
+        logger.info(f"Sample data:\n{df.head().to_csv(index=False)}")
+        
+        # Additional validation: check if DataFrame has meaningful data
+        if len(df.columns) > 0 and len(df) > 0:
+            return df
+        else:
+            raise ValueError("Generated DataFrame is empty or has no columns.")
+    elif isinstance(df, pd.DataFrame):
+        raise ValueError("Generated DataFrame is empty.")
+    else:
+        raise ValueError("Fallback code did not return a DataFrame.")
+
+# Scraping code that worked, keyed by site + page tag skeleton + task, so a structurally identical page
+# (same template, new content) runs the stored code instead of going back to the LLM.
+_CODE_CACHE_PATH = '.scrape_code_cache.sqlite'
+_CODE_CACHE = None
+_CODE_CACHE_LOCK = threading.Lock()
+
+def _code_cache() -> sqlite3.Connection:
+    global _CODE_CACHE
+    if _CODE_CACHE is None:
+        _CODE_CACHE = sqlite3.connect(_CODE_CACHE_PATH, check_same_thread=False)
+        _CODE_CACHE.execute("CREATE TABLE IF NOT EXISTS scrape_code (netloc TEXT, fingerprint TEXT, code TEXT, PRIMARY KEY (netloc, fingerprint))")
+    return _CODE_CACHE
+
+def _page_fingerprint(soup: BeautifulSoup, task_description: str) -> str:
+    """Hash of the first 2000 tag names plus the task (the same layout can need different code per task)."""
+    skeleton = ''.join(tag.name for tag in soup.find_all(True, limit=2000))
+    return hashlib.blake2b(f"{skeleton}\0{task_description}".encode(), digest_size=16).hexdigest()
+
+def _load_cached_code(netloc: str, fingerprint: str):
+    with _CODE_CACHE_LOCK:
+        row = _code_cache().execute("SELECT code FROM scrape_code WHERE netloc=? AND fingerprint=?", (netloc, fingerprint)).fetchone()
+    return row[0] if row else None
+
+def _store_cached_code(netloc: str, fingerprint: str, code: str):
+    with _CODE_CACHE_LOCK:
+        _code_cache().execute("INSERT OR REPLACE INTO scrape_code VALUES (?, ?, ?)", (netloc, fingerprint, code))
+        _code_cache().commit()
+
 def extract_relevant_data(url: str, task_description: str, max_retries: int = 10) -> pd.DataFrame:
     """
     Extracts a relevant DataFrame from a URL.
@@ -106,93 +461,100 @@ def extract_relevant_data(url: str, task_description: str, max_retries: int = 10
     3.  If `read_html` fails, falls back to the LLM generating code from scratch.
     """
     logger.info(f"🚀 Starting robust data extraction from URL: {url}")
-    response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+    # Not streamed: the cached session reads the whole body to store it anyway, and a hit is already in memory
+    response = _get_session().get(url, headers=_UA_HEADERS, timeout=(5, 30))
     response.raise_for_status()
+    content = response.content
+    encoding = _response_encoding(response)
 
     # --- STRATEGY 1: Use pandas.read_html (fast and reliable) ---
     try:
         logger.info("Attempting to parse tables with pandas.read_html...")
-        # We use StringIO to avoid the FutureWarning
-        tables = pd.read_html(StringIO(response.text))
+        tables = _read_candidate_tables(content, encoding)
+        if tables:
+            logger.info(f"Kept {len(tables)} table(s) after skipping tiny layout tables.")
+        else:
+            # Nothing passed the size filter; let read_html see the whole page as before
+            tables = pd.read_html(BytesIO(_clamp_spans(content)), flavor='lxml', encoding=encoding)
         
         if not tables:
             raise ValueError("pandas.read_html found no tables on the page.")
 
-        logger.info(f"✅ Found {len(tables)} tables. Asking LLM to select the best one.")
+        logger.info(f"✅ Found {len(tables)} tables. Selecting the best one.")
 
         if len(tables) == 1:
             logger.info("Only one table found, returning it directly.")
             return tables[0]
 
+        # Try the local embedding match first; it costs milliseconds instead of an LLM round-trip
+        best_index = _select_table_by_embedding(tables, task_description)
+        if best_index is not None:
+            logger.info(f"✅ Embedding similarity selected table index: {best_index}. Returning it.")
+            return tables[best_index]
+
         # If multiple tables, ask LLM to pick the right one (optimized prompt)
         selection_prompt = f"""
 Select the most relevant table for this task: "{task_description}"
 
 Found {len(tables)} tables:
 """
-        for i, df in enumerate(tables):
-            # Show only essential information - much smaller preview
-            preview_rows = min(5, len(df))  # Only 5 rows max
-            table_preview = df.head(preview_rows).to_string(max_rows=5, max_cols=10, max_colwidth=15)
-            
-            # Basic table information only
-            table_info = f"Shape: {df.shape}"
-            column_names = f"Columns: {list(df.columns)[:10]}"  # Max 10 columns
-            
-            selection_prompt += f"""
-Table {i}: {table_info} | {column_names}
-Preview:
-{table_preview[:500]}  
-
-"""
+        # Build the previews concurrently; pages with dozens of tables spend most of this in to_string
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            previews = list(executor.map(_table_preview, tables))
+        selection_prompt += "".join(f"\nTable {i}: {preview}\n\n" for i, preview in enumerate(previews))
         
         selection_prompt += "Return ONLY the table index number (0, 1, 2, etc.)."
 
-        llm_response = llm(selection_prompt).strip()
-        best_index = int(re.search(r'\d+', llm_response).group())
-        
+        # Stored only once the reply has parsed to an index that exists
+        llm_response = cached_llm(selection_prompt, namespace="table_select", store=False).strip()
+        best_index = int(_INT_RE.search(llm_response).group())
+        table = tables[best_index]
+        cache_put(selection_prompt, "table_select", llm_response)
+
         logger.info(f"✅ LLM selected table index: {best_index}. Returning it.")
-        return tables[best_index]
+        return table
 
     except Exception as e:
         logger.warning(f"⚠️ pandas.read_html strategy failed: {e}. Falling back to LLM code generation.")
 
     # --- STRATEGY 2: Fallback to LLM generating code ---
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = _parse_html(_clamp_spans(content), encoding)
+    netloc = urlparse(url).netloc
+    fingerprint = _page_fingerprint(soup, task_description)
+    cached_code = _load_cached_code(netloc, fingerprint)
+    if cached_code:
+        try:
+            df = _run_scraping_code(cached_code, soup)
+            logger.info("⚡ Reused cached scraping code for this page layout.")
+            return df
+        except Exception as e:
+            logger.warning(f"⚠️ Cached scraping code no longer works ({type(e).__name__}: {e}); regenerating.")
+
     error_log = ""
     for attempt in range(max_retries):
         logger.info(f"Fallback attempt {attempt + 1} of {max_retries}...")
-        scraping_code = llm_generate_scraping_code(soup, task_description, error_log)
+        if error_log:
+            candidates = _scraping_code_candidates(soup, task_description, error_log)
+        else:
+            candidates = [llm_generate_scraping_code(soup, task_description)]
         
-        try:
-            local_vars = {"soup": soup, "pd": pd, "result": None}
-            exec(scraping_code, {}, local_vars)
-            df = local_vars.get("result")
-            
-            # Validate that the result is appropriate for the task
-            if isinstance(df, pd.DataFrame) and not df.empty:
-                # Check if the scraped data is relevant to the task
-                logger.info(f"✅ Generated DataFrame with shape {df.shape}")
-                logger.info(f"DataFrame columns: {list(df.columns)}")
-                logger.info(f"Sample data:\n{df.head().to_string()}")
-                
-                # Additional validation: check if DataFrame has meaningful data
-                if len(df.columns) > 0 and len(df) > 0:
-                    logger.info(f"✅ Fallback LLM generation succeeded on attempt {attempt + 1}.")
-                    return df
-                else:
-                    raise ValueError("Generated DataFrame is empty or has no columns.")
-            elif isinstance(df, pd.DataFrame):
-                raise ValueError("Generated DataFrame is empty.")
-            else:
-                raise ValueError("Fallback code did not return a DataFrame.")
-                
-        except Exception as e:
-            import traceback
-            full_traceback = traceback.format_exc()
-            # Keep only essential error info to avoid huge prompts
-            error_summary = f"{type(e).__name__}: {str(e)}"
-            logger.warning(f"⚠️ Fallback attempt {attempt + 1} failed: {error_summary}")
-            error_log = error_summary  # Pass only summary instead of full traceback
+        for scraping_code in candidates:
+            # Missing imports / an unassigned `result` are patched statically instead of costing a correction round-trip
+            repaired = auto_repair(scraping_code, _scrape_namespace(soup))
+            if repaired:
+                logger.info("🔧 Auto-repaired scraping code locally before running it.")
+                scraping_code = repaired
+            try:
+                df = _run_scraping_code(scraping_code, soup)
+                logger.info(f"✅ Fallback LLM generation succeeded on attempt {attempt + 1}.")
+                _store_cached_code(netloc, fingerprint, scraping_code)
+                # Whichever attempt produced it, this is the code that works for the first-attempt prompt
+                cache_put(_scraping_prompt(soup, task_description), "scrape_gen", scraping_code)
+                return df
+            except Exception as e:
+                # Keep only essential error info to avoid huge prompts
+                error_summary = f"{type(e).__name__}: {str(e)}"
+                logger.warning(f"⚠️ Fallback attempt {attempt + 1} failed: {error_summary}")
+                error_log = error_summary  # Pass only summary instead of full traceback
 
     raise RuntimeError("All scraping strategies failed.")
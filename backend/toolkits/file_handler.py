@@ -1,4 +1,8 @@
+import binascii
+import duckdb
 import mimetypes
+import mmap
+import numpy as np
 import pandas as pd
 import base64
 from PyPDF2 import PdfReader
@@ -7,76 +11,266 @@ from io import BytesIO
 import logging
 import io
 import os
+import re
 import json
 import base64
+import collections
+import hashlib
+import threading
 import traceback
-from backend.llm_agent import llm, llm_vision
-from .fetch import extract_python_code
+from backend.llm_agent import llm, llm_vision, llm_many, correction_variants
+from functools import lru_cache
+from ._code_extract import extract_python_code, compile_code, auto_repair
 
 # For images and PDFs
 from PIL import Image
 import pdfplumber
+import pypdfium2 as pdfium  # PDFium (C++) for page counts and text; pdfplumber is kept for table detection
 
 # Note: OCR libraries will be imported dynamically by the LLM when text extraction from images is needed
 
+# Rust-based Excel reader (python-calamine) is much faster than openpyxl; optional
+try:
+    import python_calamine  # noqa: F401
+    _EXCEL_ENGINE = 'calamine'
+except ImportError:
+    _EXCEL_ENGINE = None
+
+# fastexcel (calamine + Arrow) can load just the first rows of a sheet into Arrow for previews; optional
+try:
+    import fastexcel
+except ImportError:
+    fastexcel = None
+
 logger = logging.getLogger(__name__)
 
+# Dtypes/info in previews are inferred from this many leading rows instead of loading the whole file
+_PREVIEW_SAMPLE_ROWS = 1000
+# Head/tail tables are capped in width so wide files don't blow up the prompt; Info still lists every column
+_PREVIEW_MAX_COLS = 20
+_PREVIEW_MAX_COLWIDTH = 40
+
+def _frame_preview(df: pd.DataFrame) -> str:
+    """Plain-text table of a preview slice; to_string is far cheaper than tabulate-backed to_markdown."""
+    return df.iloc[:, :_PREVIEW_MAX_COLS].to_string(max_colwidth=_PREVIEW_MAX_COLWIDTH)
+
+_LINE_COUNT_WINDOW = 64 << 20  # bytes compared per step; bounds the temporary boolean array
+
+def _fast_line_count(file_path: str) -> int:
+    """
+    Number of lines in a file, counted over an mmap'ed view with vectorized numpy compares
+    (no read() copies, no parsing). A final line without a trailing newline still counts.
+    """
+    if os.path.getsize(file_path) == 0:
+        return 0
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = np.frombuffer(mm, dtype=np.uint8)
+        try:
+            newlines = 0
+            for start in range(0, len(data), _LINE_COUNT_WINDOW):
+                newlines += int(np.count_nonzero(data[start:start + _LINE_COUNT_WINDOW] == 10))
+            unterminated = data[-1] != 10
+        finally:
+            del data  # release the buffer export before the mmap is closed
+    return newlines + (1 if unterminated else 0)
+
+_QUOTE_SNIFF_BYTES = 64 << 10  # leading bytes checked for quoting before trusting a raw newline count
+
+def _count_data_rows(file_path: str) -> int:
+    """
+    Data rows in a CSV. Lines minus the header when the leading bytes contain no quote character;
+    otherwise quoted fields may span lines, so DuckDB parses the file and counts the records.
+    """
+    with open(file_path, 'rb') as f:
+        quoted = b'"' in f.read(_QUOTE_SNIFF_BYTES)
+    if quoted:
+        try:
+            with duckdb.connect() as con:
+                return con.execute("SELECT count(*) FROM read_csv_auto(?)", [file_path]).fetchone()[0]
+        except duckdb.Error as e:
+            logger.warning(f"⚠️ DuckDB could not count CSV rows, using the line count instead: {e}")
+    return max(_fast_line_count(file_path) - 1, 0)
+
+_DUCKDB_NUMERIC_TYPES = ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT',
+                         'UINTEGER', 'UBIGINT', 'UHUGEINT', 'FLOAT', 'DOUBLE', 'DECIMAL')
+
+def _csv_column_types(file_path: str) -> list:
+    """(name, DuckDB type) per CSV column from DuckDB's sniffer, which samples rows across the whole file."""
+    with duckdb.connect() as con:
+        return [(row[0], row[1]) for row in con.execute("DESCRIBE SELECT * FROM read_csv_auto(?)", [file_path]).fetchall()]
+
+_TAIL_WINDOW = 64 << 10  # initial bytes read off the end of a CSV for its tail preview
+
+def _read_csv_tail(file_path: str, columns: list, n: int) -> pd.DataFrame:
+    """
+    Last `n` rows of a CSV, parsed from a window seeked off the end of the file (grown until it holds
+    `n` whole lines) instead of tokenizing every row before them. Raises ParserError if the window
+    cut lands inside a quoted multi-line field badly enough to break parsing.
+    """
+    size = os.path.getsize(file_path)
+    window = _TAIL_WINDOW
+    with open(file_path, 'rb') as f:
+        while True:
+            start = max(size - window, 0)
+            f.seek(start)
+            data = f.read()
+            # The first line of the window is either partial or (at offset 0) the header; drop it
+            if start == 0 or data.count(b'\n') > n + 1:
+                data = data.split(b'\n', 1)[1] if b'\n' in data else b''
+                break
+            window *= 4
+    tail = pd.read_csv(BytesIO(data), header=None, names=columns)
+    return tail.tail(n)
+
+def _as_read_excel_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Excel stores every number as a float; like `pd.read_excel`, show whole-number columns as int64."""
+    for col in df.columns:
+        values = df[col]
+        if values.dtype == np.float64 and values.notna().all() and (values % 1 == 0).all():
+            df[col] = values.astype(np.int64)
+    return df
+
+def _open_workbook(file_path: str):
+    """
+    Returns the sheet names and a `load(sheet, nrows)` -> DataFrame reader for previews. Prefers fastexcel,
+    which only decodes the requested rows, then the already-opened pandas workbook.
+    """
+    if fastexcel is not None:
+        reader = fastexcel.read_excel(file_path)
+        return reader.sheet_names, lambda sheet, nrows: _as_read_excel_dtypes(reader.load_sheet(sheet, n_rows=nrows).to_pandas())
+    excel_file = pd.ExcelFile(file_path, engine=_EXCEL_ENGINE)
+    return excel_file.sheet_names, lambda sheet, nrows: pd.read_excel(excel_file, sheet_name=sheet, nrows=nrows)
+
+def _file_version(file_path: str) -> tuple:
+    """(mtime_ns, size) of a file; part of every cache key below so a rewritten file is re-read."""
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+_PDF_TABLE_SCAN_PAGES = 20  # pages checked for table rulings in a preview
+_FIRST_PAGE_TEXT_CHARS = 1000  # first-page text shown in a preview
+_MIN_TABLE_RULINGS = 3  # horizontal and vertical edges each needed to flag a page as table-likely
+
+def _has_table_rulings(page) -> bool:
+    """Cheap table hint from the page's drawn lines/rect edges; doesn't run pdfplumber's table finder."""
+    edges = page.edges
+    horizontal = sum(1 for edge in edges if edge['orientation'] == 'h')
+    vertical = len(edges) - horizontal
+    return horizontal >= _MIN_TABLE_RULINGS and vertical >= _MIN_TABLE_RULINGS
+
+def _scan_table_pages(file_path: str, page_numbers: list) -> list:
+    """Table-likely page numbers among `page_numbers` (1-based), from a single pdfplumber open."""
+    table_pages = []
+    with pdfplumber.open(file_path, pages=[int(n) for n in page_numbers]) as pdf:
+        for page in pdf.pages:
+            if _has_table_rulings(page):
+                table_pages.append(page.page_number)
+            page.close()
+    return table_pages
+
+@lru_cache(maxsize=64)
+def _pdf_stats(file_path: str, version: tuple) -> tuple:
+    """
+    (page count, first page text, table-likely page numbers within the first _PDF_TABLE_SCAN_PAGES pages)
+    of a PDF version, shared by the preview and the code-generation prompt.
+    """
+    doc = pdfium.PdfDocument(file_path)
+    try:
+        num_pages = len(doc)
+        first_page_text = ''
+        if num_pages > 0:
+            page = doc[0]
+            textpage = page.get_textpage()
+            # Only the characters the preview shows are pulled out of PDFium
+            first_page_text = textpage.get_text_range(count=_FIRST_PAGE_TEXT_CHARS)
+            textpage.close()
+            page.close()
+    finally:
+        doc.close()
+    # At most _PDF_TABLE_SCAN_PAGES pages are scanned, serially: a process pool (which would have to
+    # re-open the PDF per worker) costs more than it saves at that size
+    page_numbers = list(range(1, min(num_pages, _PDF_TABLE_SCAN_PAGES) + 1))
+    return num_pages, first_page_text, _scan_table_pages(file_path, page_numbers)
+
 def _preview_file(file_path: str, file_type: str, max_rows: int = 5) -> str:
     """
     Generate a comprehensive preview string for the file based on its type.
+    Previews are memoized per file version, so retries on the same file don't re-parse it.
     """
+    try:
+        version = _file_version(file_path)
+    except OSError as e:
+        return f"Error previewing file: {e}"
+    return _preview_cached(file_path, version, file_type, max_rows)
+
+@lru_cache(maxsize=64)
+def _preview_cached(file_path: str, version: tuple, file_type: str, max_rows: int) -> str:
     try:
         file_size = os.path.getsize(file_path)
         size_mb = file_size / (1024 * 1024)
         
         if file_type == 'csv':
-            # Enhanced CSV preview with memory optimization
-            chunk_size = 1000 if size_mb > 50 else None
-            if chunk_size:
-                df = pd.read_csv(file_path, nrows=max_rows * 2)  # Read more for better preview
-                logger.info(f"Large CSV file ({size_mb:.1f}MB) - using optimized preview")
-            else:
-                df = pd.read_csv(file_path)
+            # Only the leading sample and the last rows are parsed; the row count comes from a raw newline scan
+            # (or a DuckDB count when quoted fields could span lines)
+            df = pd.read_csv(file_path, nrows=_PREVIEW_SAMPLE_ROWS)
+            total_rows = _count_data_rows(file_path) if len(df) == _PREVIEW_SAMPLE_ROWS else len(df)
+            tail = df
+            if total_rows > len(df):
+                try:
+                    tail = _read_csv_tail(file_path, list(df.columns), max_rows)
+                    tail.index = range(total_rows - len(tail), total_rows)
+                except pd.errors.ParserError:
+                    tail = pd.read_csv(file_path, skiprows=range(1, max(1, total_rows - max_rows + 1)))
             
             buffer = io.StringIO()
             df.info(buf=buffer)
             info = buffer.getvalue()
             
-            # Enhanced preview with statistics
-            numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-            text_cols = df.select_dtypes(include=['object']).columns.tolist()
+            # Enhanced preview with statistics; column kinds come from DuckDB's file-wide sniff, not just the sample
+            try:
+                column_types = _csv_column_types(file_path)
+                numeric_cols = [name for name, kind in column_types if kind.startswith(_DUCKDB_NUMERIC_TYPES)]
+                text_cols = [name for name, kind in column_types if kind == 'VARCHAR']
+            except duckdb.Error:
+                numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+                text_cols = df.select_dtypes(include=['object']).columns.tolist()
             
-            preview = f"--- File Info ---\nSize: {size_mb:.1f}MB, Rows: {len(df)}, Columns: {len(df.columns)}\n"
+            preview = f"--- File Info ---\nSize: {size_mb:.1f}MB, Rows: {total_rows}, Columns: {len(df.columns)}\n"
             preview += f"Numeric columns: {numeric_cols[:5]}{'...' if len(numeric_cols) > 5 else ''}\n"
             preview += f"Text columns: {text_cols[:5]}{'...' if len(text_cols) > 5 else ''}\n\n"
-            preview += f"--- Head ({max_rows} rows) ---\n{df.head(max_rows).to_markdown()}\n"
-            preview += f"--- Tail ({max_rows} rows) ---\n{df.tail(max_rows).to_markdown()}\n"
-            preview += f"--- DataFrame Info ---\n{info}"
+            preview += f"--- Head ({max_rows} rows) ---\n{_frame_preview(df.head(max_rows))}\n"
+            preview += f"--- Tail ({max_rows} rows) ---\n{_frame_preview(tail.tail(max_rows))}\n"
+            sample_note = f" (dtypes inferred from the first {len(df)} rows)" if total_rows > len(df) else ""
+            preview += f"--- DataFrame Info{sample_note} ---\n{info}"
             return preview
         elif file_type == 'excel':
             # Enhanced Excel preview with multi-sheet support
-            excel_file = pd.ExcelFile(file_path)
-            sheet_names = excel_file.sheet_names
+            sheet_names, load_sheet = _open_workbook(file_path)
             
             if len(sheet_names) > 1:
                 preview = f"--- Excel File Info ---\nSize: {size_mb:.1f}MB, Sheets: {len(sheet_names)}\nSheet names: {sheet_names}\n\n"
                 for i, sheet in enumerate(sheet_names[:3]):  # Preview first 3 sheets
                     try:
-                        df = pd.read_excel(file_path, sheet_name=sheet, nrows=max_rows)
+                        # Reuse the already-opened workbook instead of re-reading the file per sheet
+                        df = load_sheet(sheet, max_rows)
                         preview += f"--- Sheet '{sheet}' Preview ---\n"
                         preview += f"Shape: {df.shape}\n"
-                        preview += f"{df.head(max_rows).to_markdown()}\n\n"
+                        preview += f"{_frame_preview(df.head(max_rows))}\n\n"
                     except Exception as e:
                         preview += f"--- Sheet '{sheet}' ---\nError reading sheet: {str(e)}\n\n"
                 if len(sheet_names) > 3:
                     preview += f"... and {len(sheet_names) - 3} more sheets\n"
             else:
-                df = pd.read_excel(file_path, sheet_name=sheet_names[0])
+                # A tail would need the whole sheet parsed, so the preview sticks to a leading sample
+                df = load_sheet(sheet_names[0], _PREVIEW_SAMPLE_ROWS)
                 buffer = io.StringIO()
                 df.info(buf=buffer)
                 info = buffer.getvalue()
                 preview = f"--- Excel File Info ---\nSize: {size_mb:.1f}MB, Single sheet: '{sheet_names[0]}'\n"
-                preview += f"--- Head ---\n{df.head(max_rows).to_markdown()}\n--- Tail ---\n{df.tail(max_rows).to_markdown()}\n--- Info ---\n{info}"
+                preview += f"--- Head ---\n{_frame_preview(df.head(max_rows))}\n"
+                if len(df) < _PREVIEW_SAMPLE_ROWS:
+                    preview += f"--- Tail ---\n{_frame_preview(df.tail(max_rows))}\n--- Info ---\n{info}"
+                else:
+                    preview += f"--- Info (first {_PREVIEW_SAMPLE_ROWS} rows) ---\n{info}"
             return preview
         elif file_type == 'image':
             with Image.open(file_path) as img:
@@ -84,27 +278,19 @@ def _preview_file(file_path: str, file_type: str, max_rows: int = 5) -> str:
         elif file_type == 'pdf':
             # Enhanced PDF preview with table detection
             try:
-                with pdfplumber.open(file_path) as pdf:
-                    num_pages = len(pdf.pages)
-                    first_page_text = pdf.pages[0].extract_text() if num_pages > 0 else ''
-                    
-                    # Check for tables across all pages (not just first 5)
-                    total_tables = 0
-                    table_pages = []
-                    for i, page in enumerate(pdf.pages):  # Check ALL pages
-                        tables = page.extract_tables()
-                        if tables:
-                            total_tables += len(tables)
-                            table_pages.append(i + 1)
-                    
-                    preview = f"--- PDF File Info ---\nSize: {size_mb:.1f}MB, Pages: {num_pages}\n"
-                    preview += f"Tables detected: {total_tables} across pages {table_pages}\n\n"
-                    preview += f"--- First Page Text Preview ---\n{first_page_text[:1000]}..."
-                    
-                    if total_tables > 0:
-                        preview += f"\n\n--- Table Extraction Capability ---\nDetected {total_tables} tables that can be extracted as DataFrames"
-                    
-                    return preview
+                # Table pages are flagged from ruling lines only; the generated script does the real extraction
+                num_pages, first_page_text, table_pages = _pdf_stats(file_path, version)
+                scanned = min(num_pages, _PDF_TABLE_SCAN_PAGES)
+                scan_note = f" (scanned first {scanned} of {num_pages} pages)" if num_pages > scanned else ""
+
+                preview = f"--- PDF File Info ---\nSize: {size_mb:.1f}MB, Pages: {num_pages}\n"
+                preview += f"Likely table pages (ruled lines): {table_pages}{scan_note}\n\n"
+                preview += f"--- First Page Text Preview ---\n{first_page_text}..."
+
+                if table_pages:
+                    preview += f"\n\n--- Table Extraction Capability ---\nPages {table_pages} look like they hold tables that can be extracted as DataFrames"
+
+                return preview
             except Exception as e:
                 return f"PDF file ({size_mb:.1f}MB, error reading: {str(e)[:100]})"
         else:
@@ -112,22 +298,29 @@ def _preview_file(file_path: str, file_type: str, max_rows: int = 5) -> str:
     except Exception as e:
         return f"Error previewing file: {e}"
 
+# Extension -> file type, shared by `_detect_file_type` (codegen path) and `detect_type` (content extraction)
+_EXT_MAP = {
+    'csv': 'csv',
+    'json': 'json',
+    'xlsx': 'excel',
+    'xls': 'excel',
+    'pdf': 'pdf',
+    'png': 'image',
+    'jpg': 'image',
+    'jpeg': 'image',
+    'bmp': 'image',
+    'gif': 'image',
+    'py': 'python',
+    'sql': 'sql',
+}
+_HANDLED_FILE_TYPES = ('csv', 'excel', 'image', 'pdf')  # types `handle_file_task` can preview and process
+
 def _detect_file_type(file_path: str) -> str:
-    ext = os.path.splitext(file_path)[-1].lower()
-    if ext in ['.csv']:
-        return 'csv'
-    elif ext in ['.xls', '.xlsx']:
-        return 'excel'
-    elif ext in ['.png', '.jpg', '.jpeg', '.bmp', '.gif']:
-        return 'image'
-    elif ext in ['.pdf']:
-        return 'pdf'
-    else:
-        return 'unknown'
+    file_type = _EXT_MAP.get(file_path.rsplit('.', 1)[-1].lower())
+    return file_type if file_type in _HANDLED_FILE_TYPES else 'unknown'
 
-def _correct_file_code(failed_code: str, error_message: str, task: str, file_preview: str, file_type: str) -> str:
-    logger.info("🤖 Attempting to correct failed file handler code...")
-    prompt = f"""
+def _file_correction_prompt(failed_code: str, error_message: str, task: str, file_preview: str, file_type: str) -> str:
+    return f"""
 You are a Senior Python Data Scientist and expert code debugger.
 The following Python script failed to execute. Your task is to analyze the error traceback and provide a corrected version of the script.
 
@@ -168,8 +361,93 @@ The following Python script failed to execute. Your task is to analyze the error
 
 **Corrected Code:**
 """
-    raw_corrected_code = llm(prompt).strip()
-    return extract_python_code(raw_corrected_code)
+
+# First correction that actually ran, per (failed code, error, task, file type); in-process and bounded
+_PINNED_CORRECTIONS = collections.OrderedDict()
+_PINNED_CORRECTIONS_MAX = 128
+_PINNED_CORRECTIONS_LOCK = threading.Lock()
+
+def _correction_key(failed_code: str, error_message: str, task: str, file_type: str) -> str:
+    return hashlib.sha256("\0".join((failed_code, error_message, task, file_type)).encode()).hexdigest()
+
+def _pin_correction(key: str, code: str):
+    """Remembers `code` as the fix for `key`; only called once that code has run and validated."""
+    with _PINNED_CORRECTIONS_LOCK:
+        _PINNED_CORRECTIONS[key] = code
+        _PINNED_CORRECTIONS.move_to_end(key)
+        if len(_PINNED_CORRECTIONS) > _PINNED_CORRECTIONS_MAX:
+            _PINNED_CORRECTIONS.popitem(last=False)
+
+def _correct_file_code_candidates(failed_code: str, error_message: str, task: str, file_preview: str, file_type: str, key: str) -> list:
+    """
+    Requests several corrections concurrently; the caller runs them in order and keeps the first that works.
+    A repeat of a failure already fixed in this process replays that fix instead of asking the LLM again.
+    """
+    with _PINNED_CORRECTIONS_LOCK:
+        pinned = _PINNED_CORRECTIONS.get(key)
+    if pinned is not None:
+        logger.info("⚡ Reusing the correction that fixed this exact failure before.")
+        return [pinned]
+    logger.info("🤖 Requesting corrected file handler code candidates...")
+    prompts = correction_variants(_file_correction_prompt(failed_code, error_message, task, file_preview, file_type))
+    # Uncached: a stored answer would be replayed even when it failed; only working fixes are pinned above
+    responses = llm_many(prompts)
+    candidates = []
+    for response in responses:
+        code = extract_python_code(response.strip())
+        if code and code not in candidates:
+            candidates.append(code)
+    return candidates or [failed_code]
+
+def _file_namespace(file_path: str) -> dict:
+    """Names the generated file handler code runs with."""
+    return {
+        "file_path": file_path,
+        "pd": pd, "io": io, "os": os, "json": json, "base64": base64,
+        "Image": Image, "pdfplumber": pdfplumber, "PdfReader": PdfReader, 
+        "result": None
+    }
+
+# Substring matches (no word boundaries), so e.g. "tables" and "contents" still count
+_TABLE_TASK_RE = re.compile(r"table|dataframe|tabular|structured|csv|excel", re.IGNORECASE)
+_TEXT_TASK_RE = re.compile(r"text|content|document", re.IGNORECASE)
+
+def _run_file_code(code: str, file_path: str, task_description: str):
+    """Executes one generated script and validates/normalizes its `result`; raises on any failure."""
+    local_vars = _file_namespace(file_path)
+    exec(compile_code(code, '<file_handler>'), local_vars)
+    final_result = local_vars.get("result")
+    if final_result is None:
+        raise ValueError("File handler code did not assign a value to the 'result' variable.")
+
+    # Validate return type based on task description (images handled separately)
+    if _TABLE_TASK_RE.search(task_description):
+        if not isinstance(final_result, (pd.DataFrame, dict)):
+            raise ValueError(f"Expected pandas DataFrame or dict of DataFrames for table data, got {type(final_result)}")
+    elif _TEXT_TASK_RE.search(task_description):
+        if not isinstance(final_result, str):
+            raise ValueError(f"Expected string for text data, got {type(final_result)}")
+
+    return _to_python(final_result)
+
+_NATIVE_LEAVES = (str, int, float, bool, type(None))
+
+def _to_python(value):
+    """
+    Converts numpy scalars/arrays anywhere in a (nested) dict or list result to native Python types in one pass.
+    Arrays go through `tolist()` in C; DataFrames and other objects are returned as they are.
+    """
+    if isinstance(value, _NATIVE_LEAVES):
+        return value
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: _to_python(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_python(item) for item in value]
+    return value
 
 def handle_file_task(task_description: str, full_task: str, file_path: str, max_retries: int = 3):
     """
@@ -210,11 +488,10 @@ You are an expert image analyst. Based on the task description below, analyze th
     pdf_page_info = ""
     if file_type == 'pdf':
         try:
-            import pdfplumber
-            with pdfplumber.open(file_path) as pdf:
-                num_pages = len(pdf.pages)
-                pdf_page_info = f" **CRITICAL FOR PDFs: This PDF has {num_pages} pages total - you MUST process ALL {num_pages} pages, not just the pages where tables were detected.**"
-        except:
+            # Same version key as the preview above, so this is a cache hit, not another PDF open
+            num_pages, _, _ = _pdf_stats(file_path, _file_version(file_path))
+            pdf_page_info = f" **CRITICAL FOR PDFs: This PDF has {num_pages} pages total - you MUST process ALL {num_pages} pages, not just the pages where tables were detected.**"
+        except Exception:
             pdf_page_info = " **CRITICAL FOR PDFs: Process ALL pages of the PDF.**"
     
     base_prompt = f"""
@@ -261,48 +538,37 @@ This is the precise instruction for what the Python script you generate must acc
 
     logger.info("🤖 Generating initial file handler code...")
     raw_code = llm(base_prompt)
-    code = extract_python_code(raw_code)
+    candidates = [extract_python_code(raw_code)]
+    correction_key = None  # set once `candidates` are corrections, so the one that works can be pinned
 
     for attempt in range(max_retries):
-        logger.info(f"File handler attempt {attempt + 1} of {max_retries}...")
-        try:
-            logger.info(f"Executing File Handler Code:\n---START-CODE---\n{code}\n---END-CODE---")
-            local_vars = {
-                "file_path": file_path,
-                "pd": pd, "io": io, "os": os, "json": json, "base64": base64,
-                "Image": Image, "pdfplumber": pdfplumber, "PdfReader": PdfReader, 
-                "result": None
-            }
-            exec(code, local_vars)
-            final_result = local_vars.get("result")
-            if final_result is not None:
-                # Validate return type based on task description (images handled separately)
-                task_lower = task_description.lower()
-                if any(keyword in task_lower for keyword in ["table", "dataframe", "tabular", "structured", "csv", "excel"]):
-                    if not isinstance(final_result, (pd.DataFrame, dict)):
-                        raise ValueError(f"Expected pandas DataFrame or dict of DataFrames for table data, got {type(final_result)}")
-                elif any(keyword in task_lower for keyword in ["text", "content", "extract text", "document"]):
-                    if not isinstance(final_result, str):
-                        raise ValueError(f"Expected string for text data, got {type(final_result)}")
-                
+        logger.info(f"File handler attempt {attempt + 1} of {max_retries} ({len(candidates)} candidate(s))...")
+        # Each attempt tries every candidate fix; the first one that runs and validates wins
+        for code in candidates:
+            # Missing imports / an unassigned `result` are patched statically instead of costing a correction round-trip
+            repaired = auto_repair(code, _file_namespace(file_path))
+            if repaired:
+                logger.info("🔧 Auto-repaired file handler code locally before running it.")
+                code = repaired
+            try:
+                logger.info(f"Executing File Handler Code:\n---START-CODE---\n{code}\n---END-CODE---")
+                final_result = _run_file_code(code, file_path, task_description)
                 logger.info("✅ Successfully executed file handler code.")
-                if hasattr(final_result, 'item'):
-                    return final_result.item()
-                if isinstance(final_result, dict):
-                    return {k: (v.item() if hasattr(v, 'item') else v) for k, v in final_result.items()}
-                if isinstance(final_result, list):
-                    return [item.item() if hasattr(item, 'item') else item for item in final_result]
+                if correction_key is not None:
+                    _pin_correction(correction_key, code)
                 return final_result
-            else:
-                raise ValueError("File handler code did not assign a value to the 'result' variable.")
-        except Exception as e:
-            error_log = traceback.format_exc()
-            logger.warning(f"⚠️ File handler attempt {attempt + 1} failed:\n{error_log}")
-            logger.debug(f"---FAILING-FILE-HANDLER-CODE---\n{code}\n---END-CODE---")
-            if attempt + 1 == max_retries:
-                logger.error("❌ All file handler attempts failed.")
-                raise RuntimeError(f"Failed to handle file after {max_retries} attempts. Last error: {e}")
-            code = _correct_file_code(code, error_log, f"{task_description}\n{full_task}", file_preview, file_type)
+            except Exception as e:
+                last_error = e
+                failed_code = code
+                error_log = traceback.format_exc()
+                logger.warning(f"⚠️ File handler attempt {attempt + 1} failed:\n{error_log}")
+                logger.debug(f"---FAILING-FILE-HANDLER-CODE---\n{code}\n---END-CODE---")
+        if attempt + 1 == max_retries:
+            logger.error("❌ All file handler attempts failed.")
+            raise RuntimeError(f"Failed to handle file after {max_retries} attempts. Last error: {last_error}")
+        correction_task = f"{task_description}\n{full_task}"
+        correction_key = _correction_key(failed_code, error_log, correction_task, file_type)
+        candidates = _correct_file_code_candidates(failed_code, error_log, correction_task, file_preview, file_type, correction_key)
 
     raise RuntimeError("File handler failed after all retries.")
 import mimetypes
@@ -312,38 +578,56 @@ from PyPDF2 import PdfReader
 from io import BytesIO
 
 
+@lru_cache(maxsize=256)
 def detect_type(filename: str) -> str:
-    ext = filename.lower().split(".")[-1]
-    return {
-        "csv": "csv",
-        "json": "json",
-        "xlsx": "excel",
-        "xls": "excel",
-        "pdf": "pdf",
-        "png": "image",
-        "jpg": "image",
-        "jpeg": "image",
-        "py": "python",
-        "sql": "sql"
-    }.get(ext, mimetypes.guess_type(filename)[0] or "unknown")
+    # Only the short suffix is lowercased, not the whole path; mimetypes is consulted only on a miss
+    ext = filename.rsplit(".", 1)[-1].lower()
+    return _EXT_MAP.get(ext) or mimetypes.guess_type(filename)[0] or "unknown"
+
+
+def _pdf_text_stream(doc, max_chars: int = 200_000):
+    """Yields non-empty page texts in order, stopping once `max_chars` have been produced."""
+    total = 0
+    for page in doc:
+        textpage = page.get_textpage()
+        try:
+            text = textpage.get_text_range()
+        finally:
+            # Release each page's native buffers as we go instead of holding every page until the document closes
+            textpage.close()
+            page.close()
+        if not text:
+            continue
+        yield text
+        total += len(text)
+        if total >= max_chars:
+            return
 
 
 def extract_content(filename: str, content: bytes) -> str:
     file_type = detect_type(filename)
 
     if file_type == "csv":
-        df = pd.read_csv(BytesIO(content))
+        # Multi-threaded Arrow parser; fall back to the C engine for inputs it rejects
+        try:
+            df = pd.read_csv(BytesIO(content), engine="pyarrow")
+        except (ValueError, NotImplementedError):
+            df = pd.read_csv(BytesIO(content))
         return df.head().to_markdown()
     elif file_type == "json":
         return content.decode("utf-8")
     elif file_type == "excel":
-        df = pd.read_excel(BytesIO(content))
+        df = pd.read_excel(BytesIO(content), engine=_EXCEL_ENGINE)
         return df.head().to_markdown()
     elif file_type == "pdf":
-        reader = PdfReader(BytesIO(content))
-        return "\n".join([page.extract_text() for page in reader.pages if page.extract_text()])
+        doc = pdfium.PdfDocument(content)
+        try:
+            return "\n".join(_pdf_text_stream(doc))
+        finally:
+            doc.close()
     elif file_type == "image":
-        encoded = base64.b64encode(content).decode("utf-8")
+        # b2a_base64 encodes straight from the buffer (no newline, no intermediate copy) and ASCII decoding is a plain copy
+        encoded = binascii.b2a_base64(memoryview(content), newline=False).decode("ascii")
         return f"data:image/png;base64,{encoded}"
     elif file_type == "python" or file_type == "sql":
         return content.decode("utf-8")
@@ -0,0 +1,187 @@
+# backend/toolkits/sandbox.py
+
+import logging
+import multiprocessing as mp
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Runs LLM-generated code in a pre-warmed worker process instead of the server process, so a
+# runaway pandas op can't blow the server's RSS or hang the event loop. DataFrames are handed
+# over as Arrow IPC streams in shared memory rather than pickled through the pipe.
+
+_SHM_MARKER = "__arrow_shm__"
+_MAX_WORKERS = 2
+_POOL = None
+_WORKER_PIDS = None  # queue the workers report their PIDs on, so a hung pool can be killed without pool internals
+
+
+def _preimport(pid_queue):
+    """Worker initializer: pay the heavy plotting/stats imports once per worker, not per task."""
+    pid_queue.put(os.getpid())
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import matplotlib.pyplot as plt
+    import pandas
+    import scipy.stats
+    import seaborn
+    # Draw one throwaway figure so the font cache is loaded before the first real plot
+    plt.figure()
+    plt.close('all')
+
+
+def _noop():
+    return None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _POOL, _WORKER_PIDS
+    if _POOL is None:
+        # Forking the multi-threaded server process is unsafe (locks held by other threads are copied
+        # mid-state), so workers come from a clean forkserver; fall back to the platform default elsewhere
+        ctx = mp.get_context('forkserver') if 'forkserver' in mp.get_all_start_methods() else mp.get_context()
+        logger.info(f"Starting sandbox worker pool ({ctx.get_start_method()} start method)...")
+        _WORKER_PIDS = ctx.SimpleQueue()
+        _POOL = ProcessPoolExecutor(max_workers=_MAX_WORKERS, mp_context=ctx, initializer=_preimport, initargs=(_WORKER_PIDS,))
+    return _POOL
+
+
+def warm_pool():
+    """
+    Starts the workers in the background (called at app startup and after a reset) so the ~3s of
+    interpreter start + plotting imports doesn't count against the first analysis timeout.
+    """
+    pool = _get_pool()
+    # The executor spawns one worker per submit while none is idle, so one no-op per worker starts them all
+    for _ in range(_MAX_WORKERS):
+        pool.submit(_noop)
+
+
+def _worker_pids() -> list:
+    pids = []
+    while not _WORKER_PIDS.empty():
+        pids.append(_WORKER_PIDS.get())
+    return pids
+
+
+def _reset_pool():
+    """Kills the workers (e.g. after a timeout) so the next task gets a fresh pool."""
+    global _POOL, _WORKER_PIDS
+    if _POOL is None:
+        return
+    # ProcessPoolExecutor has no public way to stop a hung task; signal the workers it started directly.
+    _POOL.shutdown(wait=False, cancel_futures=True)
+    for pid in _worker_pids():
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass  # already exited
+    _WORKER_PIDS.close()
+    _POOL = None
+    _WORKER_PIDS = None
+    warm_pool()
+
+
+def _export_table(table: pa.Table, as_pandas: bool, segments: list) -> tuple:
+    """Writes an Arrow table as an IPC stream straight into a new shared memory segment."""
+    mock = pa.MockOutputStream()
+    with pa.ipc.new_stream(mock, table.schema) as writer:
+        writer.write_table(table)
+    size = mock.size()
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    segments.append(shm)
+    with pa.ipc.new_stream(pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf)), table.schema) as writer:
+        writer.write_table(table)
+    return (_SHM_MARKER, shm.name, size, as_pandas)
+
+
+def _export_value(value, segments: list):
+    if isinstance(value, pa.Table):
+        return _export_table(value, False, segments)
+    if isinstance(value, pd.DataFrame):
+        # Object columns (mixed types, lists, tuples) would come back as other types, e.g. lists as
+        # ndarrays, so those frames are pickled unchanged instead
+        if (value.dtypes == object).any():
+            return value
+        try:
+            return _export_table(pa.Table.from_pandas(value), True, segments)
+        except (ValueError, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # e.g. duplicate column names (ValueError; ArrowInvalid is a subclass); pickle those frames too
+            return value
+    return value
+
+
+def share_context(data_context: dict) -> tuple:
+    """
+    Returns a picklable copy of `data_context` where DataFrames/Arrow tables (top level or one
+    dict level down, e.g. Excel sheets) are replaced by shared memory handles, plus the segments
+    the caller must unlink once the worker is done.
+    """
+    segments = []
+    shared = {}
+    for name, data in data_context.items():
+        if isinstance(data, dict):
+            shared[name] = {k: _export_value(v, segments) for k, v in data.items()}
+        else:
+            shared[name] = _export_value(data, segments)
+    return shared, segments
+
+
+def _import_value(value, handles: list):
+    if isinstance(value, tuple) and len(value) == 4 and value[0] == _SHM_MARKER:
+        _, shm_name, size, as_pandas = value
+        shm = shared_memory.SharedMemory(name=shm_name)
+        handles.append(shm)
+        table = pa.ipc.open_stream(pa.py_buffer(shm.buf)[:size]).read_all()
+        return table.to_pandas() if as_pandas else table
+    return value
+
+
+def restore_context(shared: dict, handles: list) -> dict:
+    """Worker side of `share_context`: maps the shared segments back into tables/DataFrames."""
+    restored = {}
+    for name, data in shared.items():
+        if isinstance(data, dict):
+            restored[name] = {k: _import_value(v, handles) for k, v in data.items()}
+        else:
+            restored[name] = _import_value(data, handles)
+    return restored
+
+
+def close_handles(handles: list):
+    for shm in handles:
+        try:
+            shm.close()
+        except BufferError:
+            # A zero-copy column still points into the segment; it is released when that object is freed
+            pass
+
+
+def run_in_sandbox(fn, code: str, data_context: dict, timeout: float):
+    """
+    Runs `fn(code, shared_context)` in a worker process and returns its (pickled) result.
+    `fn` must be a module-level function that calls `restore_context` on its second argument.
+    Raises TimeoutError if the code runs longer than `timeout` seconds.
+    """
+    shared, segments = share_context(data_context)
+    try:
+        future = _get_pool().submit(fn, code, shared)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            _reset_pool()
+            raise TimeoutError(f"Generated code exceeded the {timeout}s time limit and was terminated.")
+        except BrokenProcessPool:
+            # The worker died (e.g. OOM-killed); start from a fresh pool on the next attempt
+            _reset_pool()
+            raise
+    finally:
+        close_handles(segments)
+        for shm in segments:
+            shm.unlink()
@@ -1,10 +1,7 @@
 import duckdb
-import pandas as pd
 import matplotlib.pyplot as plt
 import io
-import base64
-from datetime import datetime
-from sklearn.linear_model import LinearRegression
+import binascii
 import numpy as np
 
 # S3 Parquet path
@@ -28,43 +25,47 @@ most_cases_df = con.execute(query_most_cases).df()
 most_cases_court = most_cases_df.iloc[0]["court"]
 
 # 2️⃣ Regression slope of date_of_registration - decision_date for court=33_10
+# Dates are parsed, differenced and filtered inside DuckDB; the S3 scan runs once into a two-column temp table
 query_court_delay = f"""
-SELECT date_of_registration, decision_date, year
-FROM read_parquet('{PARQUET_PATH}')
-WHERE court = '33_10'
+CREATE OR REPLACE TEMP TABLE court_delay AS
+SELECT year, delay_days
+FROM (
+    SELECT year,
+           date_diff('day', try_strptime(date_of_registration, '%d-%m-%Y'), TRY_CAST(decision_date AS DATE)) AS delay_days
+    FROM read_parquet('{PARQUET_PATH}')
+    WHERE court = '33_10'
+)
+WHERE delay_days >= 0 AND year IS NOT NULL
 """
-court_df = con.execute(query_court_delay).df()
-
-# Convert to datetime & calculate delay in days
-court_df["date_of_registration"] = pd.to_datetime(court_df["date_of_registration"], errors="coerce", format="%d-%m-%Y")
-court_df["decision_date"] = pd.to_datetime(court_df["decision_date"], errors="coerce")
-court_df["delay_days"] = (court_df["decision_date"] - court_df["date_of_registration"]).dt.days
+con.execute(query_court_delay)
 
-# Drop NaN or negative delays
-court_df = court_df.dropna(subset=["delay_days", "year"])
-court_df = court_df[court_df["delay_days"] >= 0]
+# Regression: year vs delay_days, computed as aggregates instead of pulling every row into pandas
+regression_slope, regression_intercept, min_year, max_year = con.execute("""
+SELECT regr_slope(delay_days, year), regr_intercept(delay_days, year), min(year), max(year)
+FROM court_delay
+""").fetchone()
 
-# Regression: year vs delay_days
-X = court_df[["year"]].values
-y = court_df["delay_days"].values
-model = LinearRegression().fit(X, y)
-regression_slope = model.coef_[0]
+# The scatter only needs a few thousand points to show the spread
+plot_df = con.execute("SELECT year, delay_days FROM court_delay USING SAMPLE 5000 ROWS").df()
 
 # 3️⃣ Plot scatter + regression line
+line_years = np.array([min_year, max_year], dtype=float)
 plt.figure(figsize=(6, 4))
-plt.scatter(court_df["year"], court_df["delay_days"], alpha=0.3, s=10)
-plt.plot(court_df["year"], model.predict(X), color="red", linewidth=2)
+plt.scatter(plot_df["year"], plot_df["delay_days"], alpha=0.3, s=10)
+plt.plot(line_years, regression_intercept + regression_slope * line_years, color="red", linewidth=2)
 plt.xlabel("Year")
 plt.ylabel("Delay (days)")
 plt.title("Year vs Delay Days (Court=33_10)")
 
-# Save plot to base64 (webp)
-buf = io.BytesIO()
-plt.savefig(buf, format="webp", bbox_inches="tight")
-buf.seek(0)
-img_base64 = base64.b64encode(buf.read()).decode("utf-8")
-img_data_uri = f"data:image/webp;base64,{img_base64}"
-buf.close()
+# Save plot to base64 (webp), stepping the resolution down until the data URI fits the 100,000 character limit
+for dpi in (100, 80, 60, 40):
+    buf = io.BytesIO()
+    plt.savefig(buf, format="webp", bbox_inches="tight", dpi=dpi)
+    img_data_uri = f"data:image/webp;base64,{binascii.b2a_base64(buf.getbuffer(), newline=False).decode('ascii')}"
+    buf.close()
+    if len(img_data_uri) < 100_000:
+        break
+plt.close()
 
 # 4️⃣ Prepare JSON output
 result = {
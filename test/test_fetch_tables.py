@@ -0,0 +1,30 @@
+# test/test_fetch_tables.py
+from io import StringIO
+
+import pandas as pd
+
+from backend.toolkits.fetch import _read_candidate_tables
+
+
+def _page(cells: list) -> str:
+    rows = "".join(f"<tr><td>{c}</td><td>{i}</td><td>x</td></tr>" for i, c in enumerate(cells))
+    return f"<html><body><table><tr><th>value</th><th>n</th><th>k</th></tr>{rows}</table></body></html>"
+
+
+def _assert_matches_read_html(html: str):
+    fast = _read_candidate_tables(html.encode("utf-8"))[0]
+    expected = pd.read_html(StringIO(html), flavor="lxml")[0]
+    pd.testing.assert_frame_equal(fast, expected, check_dtype=False)
+
+
+def test_br_is_a_space_not_a_join():
+    # "1,234<br>5,678" must not be parsed as the integer 12345678
+    _assert_matches_read_html(_page(["1,234<br>5,678", "a<br>b", "c<br/>d", "e"]))
+
+
+def test_nbsp_and_whitespace_runs_collapse_like_read_html():
+    _assert_matches_read_html(_page(["a&nbsp;b", "a&nbsp;&nbsp;b", "a    b", "  padded \n text  "]))
+
+
+def test_hidden_cells_are_dropped():
+    _assert_matches_read_html(_page(['a<span style="display: none">hidden</span> tail', "b", "c", "d"]))
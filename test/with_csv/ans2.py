@@ -1,11 +1,20 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
 import seaborn as sns
 import io
-import base64
+import binascii
 import json
 from pathlib import Path
 
+def _figure_to_data_uri(fig, **savefig_kwargs):
+    """Encodes a figure as a WEBP data URI; 72 DPI WEBP keeps the URIs several times smaller than 100 DPI PNG."""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='webp', dpi=72, **savefig_kwargs)
+    return f"data:image/webp;base64,{binascii.b2a_base64(buf.getbuffer(), newline=False).decode('ascii')}"
+
 def analyze_co2_data(file_path):
     """
     Loads the CO2 emissions dataset and answers a series of analytical questions.
@@ -17,7 +26,12 @@ def analyze_co2_data(file_path):
         dict: A dictionary containing the answers to the questions.
     """
     try:
-        df = pd.read_csv(file_path)
+        # Multi-threaded Arrow CSV reader; fall back to the C engine for inputs it rejects.
+        # 'country' is a categorical so the country filters and group-bys compare integer codes.
+        try:
+            df = pd.read_csv(file_path, engine='pyarrow', dtype={'country': 'category'})
+        except (ValueError, NotImplementedError):
+            df = pd.read_csv(file_path, dtype={'country': 'category'})
     except FileNotFoundError:
         print(f"Error: The file '{file_path}' was not found.")
         return None
@@ -28,70 +42,72 @@ def analyze_co2_data(file_path):
     df.dropna(subset=['year'], inplace=True)
     df['year'] = df['year'].astype(int)
 
+    # Group the rows by year and by country once; each question then takes only its slice
+    # (in file order) instead of running another boolean-mask pass over the whole frame
+    year_rows = df.groupby('year', sort=False).indices
+    country_rows = df.groupby('country', sort=False, observed=True).indices
+
+    def rows_of(groups, key):
+        return df.take(groups.get(key, np.array([], dtype=np.intp)))
+
     # --- 1. Which 5 countries have the highest total CO2 emissions in the most recent year? ---
     most_recent_year = df['year'].max()
-    df_recent = df[df['year'] == most_recent_year]
-    top_5_countries_co2 = df_recent.sort_values(by='co2', ascending=False).head(5)['country'].tolist()
+    df_recent = rows_of(year_rows, most_recent_year)
+    top_5_countries_co2 = df_recent.nlargest(5, 'co2')['country'].tolist()
 
     # --- 2. Year-over-year percentage growth of coal-based CO2 for China (2010-2020) ---
-    df_china_coal = df[
-        (df['country'] == 'China') & 
-        (df['year'].between(2010, 2020))
-    ][['year', 'coal_co2']].set_index('year')
+    df_china = rows_of(country_rows, 'China')
+    df_china_coal = df_china[df_china['year'].between(2010, 2020)][['year', 'coal_co2']].set_index('year')
     df_china_coal['yoy_growth_%'] = df_china_coal['coal_co2'].pct_change() * 100
     china_yoy_growth = df_china_coal['yoy_growth_%'].dropna().to_dict()
 
     # --- 3. Line chart of total CO2 for USA, India, UK (1990-present) ---
     countries_for_trend = ['United States', 'India', 'United Kingdom']
+    # A single mask keeps the rows in file order, which sets seaborn's hue order
     df_trend = df[
         (df['country'].isin(countries_for_trend)) & 
         (df['year'] >= 1990)
     ]
-    plt.figure(figsize=(10, 6))
-    sns.lineplot(data=df_trend, x='year', y='co2', hue='country')
-    plt.title('Total CO2 Emissions (1990-Present)')
-    plt.xlabel('Year')
-    plt.ylabel('CO2 Emissions (Million Tonnes)')
-    plt.grid(True)
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    trend_chart_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
-    trend_chart_uri = f"data:image/png;base64,{trend_chart_base64}"
+    # Standalone Agg figures: no pyplot state to manage or close between charts
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    # Explicit hue order: a categorical column would otherwise put every country in the legend
+    sns.lineplot(data=df_trend, x='year', y='co2', hue='country', hue_order=countries_for_trend, ax=ax)
+    ax.set_title('Total CO2 Emissions (1990-Present)')
+    ax.set_xlabel('Year')
+    ax.set_ylabel('CO2 Emissions (Million Tonnes)')
+    ax.grid(True)
+    trend_chart_uri = _figure_to_data_uri(fig)
 
     # --- 4. Average co2_per_capita for Africa vs. Europe (2019) ---
-    df_2019 = df[df['year'] == 2019]
+    df_2019 = rows_of(year_rows, 2019)
     avg_co2_africa_2019 = df_2019[df_2019['country'] == 'Africa']['co2_per_capita'].mean()
     avg_co2_europe_2019 = df_2019[df_2019['country'] == 'Europe']['co2_per_capita'].mean()
 
     # --- 5. Country with the highest energy_per_capita in 2021 ---
-    df_2021 = df[df['year'] == 2021].dropna(subset=['energy_per_capita'])
+    df_2021 = rows_of(year_rows, 2021).dropna(subset=['energy_per_capita'])
     highest_energy_country_2021 = df_2021.loc[df_2021['energy_per_capita'].idxmax()]['country']
 
     # --- 6. Correlation between GDP and total CO2 in 2018 ---
-    df_2018 = df[df['year'] == 2018].dropna(subset=['gdp', 'co2'])
+    df_2018 = rows_of(year_rows, 2018).dropna(subset=['gdp', 'co2'])
     gdp_co2_correlation_2018 = df_2018['gdp'].corr(df_2018['co2'])
 
     # --- 7. Bar chart of top 10 countries by cumulative CO2 ---
     # Note: 'cumulative_co2' is already in the data for the most recent year
-    df_cumulative = df_recent.dropna(subset=['cumulative_co2']).sort_values(by='cumulative_co2', ascending=False).head(10)
-    plt.figure(figsize=(12, 7))
-    sns.barplot(data=df_cumulative, x='cumulative_co2', y='country', palette='viridis')
-    plt.title('Top 10 Countries by Cumulative CO2 Emissions')
-    plt.xlabel('Cumulative CO2 Emissions (Million Tonnes)')
-    plt.ylabel('Country')
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-    cumulative_chart_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
-    cumulative_chart_uri = f"data:image/png;base64,{cumulative_chart_base64}"
+    df_cumulative = df_recent.nlargest(10, 'cumulative_co2')
+    fig = Figure(figsize=(12, 7))
+    ax = fig.add_subplot()
+    top_10_countries = df_cumulative['country'].tolist()
+    sns.barplot(data=df_cumulative, x='cumulative_co2', y='country', hue='country', order=top_10_countries,
+                hue_order=top_10_countries, palette='viridis', legend=False, dodge=False, ax=ax)
+    ax.set_title('Top 10 Countries by Cumulative CO2 Emissions')
+    ax.set_xlabel('Cumulative CO2 Emissions (Million Tonnes)')
+    ax.set_ylabel('Country')
+    cumulative_chart_uri = _figure_to_data_uri(fig, bbox_inches='tight')
 
     # --- 8. Percentage contribution of fuels for Germany in 2020 ---
-    df_germany_2020 = df[(df['country'] == 'Germany') & (df['year'] == 2020)]
+    df_germany = rows_of(country_rows, 'Germany')
+    df_germany_2020 = df_germany[df_germany['year'] == 2020]
     if not df_germany_2020.empty:
         oil_co2 = df_germany_2020['oil_co2'].iloc[0]
         coal_co2 = df_germany_2020['coal_co2'].iloc[0]
@@ -106,30 +122,26 @@ def analyze_co2_data(file_path):
         contribution_germany_2020 = "Data not available for Germany in 2020."
 
     # --- 9. Countries with negative co2_growth_prct in 2020 ---
-    countries_negative_growth_2020 = df[
-        (df['year'] == 2020) & 
-        (df['co2_growth_prct'] < 0)
-    ]['country'].tolist()
+    df_2020 = rows_of(year_rows, 2020)
+    countries_negative_growth_2020 = df_2020[df_2020['co2_growth_prct'] < 0]['country'].tolist()
 
     # --- 10. Scatter plot of GDP vs. CO2 by continent ---
     # Note: The dataset uses country names like 'Africa', 'Europe' for continents.
     continents = ['Africa', 'Asia', 'Europe', 'North America', 'South America', 'Oceania']
     df_scatter = df_recent[df_recent['country'].isin(continents)].dropna(subset=['gdp', 'co2'])
-    plt.figure(figsize=(12, 8))
-    sns.scatterplot(data=df_scatter, x='gdp', y='co2', hue='country', s=200, alpha=0.8)
-    plt.title(f'GDP vs. CO2 Emissions by Continent ({most_recent_year})')
-    plt.xlabel('GDP (Gross Domestic Product)')
-    plt.ylabel('CO2 Emissions (Million Tonnes)')
-    plt.xscale('log')
-    plt.yscale('log')
-    plt.grid(True)
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-    scatter_chart_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
-    scatter_chart_uri = f"data:image/png;base64,{scatter_chart_base64}"
+    fig = Figure(figsize=(12, 8))
+    ax = fig.add_subplot()
+    # One plain scatter per continent (a handful of points each) instead of seaborn's per-call frame handling
+    for continent, points in df_scatter.groupby('country', sort=False, observed=True):
+        ax.scatter(points['gdp'], points['co2'], label=continent, s=200, alpha=0.8)
+    ax.legend(title='country')
+    ax.set_title(f'GDP vs. CO2 Emissions by Continent ({most_recent_year})')
+    ax.set_xlabel('GDP (Gross Domestic Product)')
+    ax.set_ylabel('CO2 Emissions (Million Tonnes)')
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.grid(True)
+    scatter_chart_uri = _figure_to_data_uri(fig, bbox_inches='tight')
 
     # --- Compile final answers ---
     final_answers = {